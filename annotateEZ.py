@@ -8,9 +8,26 @@ import os
 import h5py
 import yaml
 import logging
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
 import colorsys
-import random
+import hashlib
+import socket
+import stat
+import threading
+import queue
+import getpass
+import argparse
+from abc import ABC, abstractmethod
+import time
+import json
+import io
+import cProfile
+import pstats
+import tracemalloc
 # Input
 images = []
 df = pd.DataFrame()
@@ -21,17 +38,21 @@ log_path    = 'main.log'
 
 # Logger setup
 logger = logging.getLogger(__name__)
-c_handler = logging.StreamHandler()
-console_format = logging.Formatter("[%(levelname)s] %(message)s")
-c_handler.setFormatter(console_format)
-c_handler.setLevel(logging.INFO)
-logging.getLogger().addHandler(c_handler)
-f_handler = logging.FileHandler(filename=log_path, mode='w')
-f_format = logging.Formatter("%(asctime)s: [%(levelname)s] %(message)s")
-f_handler.setFormatter(f_format)
-f_handler.setLevel(logging.DEBUG)
-logging.getLogger().addHandler(f_handler)
-logging.getLogger().setLevel(logging.DEBUG)
+
+
+def setup_logging():
+    """Log to the console and to log_path; done by main() so importing has no side effects."""
+    c_handler = logging.StreamHandler()
+    console_format = logging.Formatter("[%(levelname)s] %(message)s")
+    c_handler.setFormatter(console_format)
+    c_handler.setLevel(logging.INFO)
+    logging.getLogger().addHandler(c_handler)
+    f_handler = logging.FileHandler(filename=log_path, mode='w')
+    f_format = logging.Formatter("%(asctime)s: [%(levelname)s] %(message)s")
+    f_handler.setFormatter(f_format)
+    f_handler.setLevel(logging.DEBUG)
+    logging.getLogger().addHandler(f_handler)
+    logging.getLogger().setLevel(logging.DEBUG)
 
 
 def channels2rgb8bit(image):
@@ -53,35 +74,1210 @@ def channels2rgb8bit(image):
     return(image)
 
 
+def area_downsample(images, factor):
+    "Shrink a batch of images by averaging factor x factor pixel blocks."
+    n, h, w = images.shape[:3]
+    h, w = h - h % factor, w - w % factor
+    blocks = images[:, :h, :w].reshape(
+        (n, h // factor, factor, w // factor, factor) + images.shape[3:])
+    blocks = blocks.mean(axis=(2, 4), dtype=np.float32)
+    if np.issubdtype(images.dtype, np.integer):
+        blocks = np.rint(blocks)
+    return blocks.astype(images.dtype)
+
+
+def read_rows(dataset, ids):
+    "Read events in any order with a single increasing-index selection."
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) == 0:
+        return np.empty((0,) + dataset.shape[1:], dtype=dataset.dtype)
+    unique, inverse = np.unique(ids, return_inverse=True)
+    if len(unique) == 1:
+        return dataset[int(unique[0])][np.newaxis][inverse]
+    if unique[-1] - unique[0] + 1 == len(unique):
+        # A contiguous run is cheaper as a slice
+        rows = dataset[int(unique[0]):int(unique[-1]) + 1]
+    else:
+        rows = dataset[unique]
+    return rows[inverse]
+
+
+class ImageSource(ABC):
+    """Read-only stack of event images, indexed like an array along the first axis."""
+
+    shape = None
+    dtype = None
+    # Events per storage chunk, so callers can group reads; None if unknown
+    chunk_rows = None
+
+    @abstractmethod
+    def read(self, ids):
+        """Images for a batch of event ids, in the given order."""
+
+    def close(self):
+        pass
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.read([index])[0]
+        if isinstance(index, slice):
+            return self.read(np.arange(*index.indices(self.shape[0])))
+        return self.read(index)
+
+
+class HDF5ImageSource(ImageSource):
+    """Dataset in an HDF5 file, memory-mapped when stored contiguous and unfiltered."""
+
+    def __init__(self, path, key, memmap=True):
+        self.path = path
+        self.key = key
+        # SWMR-compatible read so a writer process may keep appending
+        try:
+            self.file_handle = h5py.File(path, 'r', swmr=True)
+        except (OSError, ValueError):
+            self.file_handle = h5py.File(path, 'r')
+        self.dataset = self.file_handle[key]
+        self.shape = self.dataset.shape
+        self.dtype = self.dataset.dtype
+        self.chunk_rows = self.dataset.chunks[0] if self.dataset.chunks else None
+        # Zero-copy view of the dataset bytes when the layout allows it
+        self.array = self._memmap_dataset() if memmap else None
+        if self.array is not None:
+            logger.info("Images are contiguous and unfiltered, reading through a memory map")
+
+    def _memmap_dataset(self):
+        """Map a contiguous, unfiltered dataset straight from the file, else None."""
+        dataset = self.dataset
+        try:
+            if (dataset.chunks is not None or dataset.compression is not None
+                    or self.file_handle.driver != 'sec2'
+                    or dataset.id.get_create_plist().get_external_count() > 0):
+                return None
+            offset = dataset.id.get_offset()
+            if offset is None:
+                # Storage was never allocated (all fill value)
+                return None
+            return np.memmap(self.path, dtype=dataset.dtype, mode='r',
+                             offset=offset, shape=dataset.shape)
+        except Exception as e:
+            logger.debug(f"Falling back to h5py reads: {e}")
+            return None
+
+    def read(self, ids):
+        if self.array is not None:
+            return self.array[np.asarray(ids, dtype=np.int64)]
+        return read_rows(self.dataset, ids)
+
+    def __getitem__(self, index):
+        if self.array is not None:
+            # A view into the OS page cache, no copy until conversion
+            return self.array[index]
+        return super().__getitem__(index)
+
+    def close(self):
+        self.array = None
+        self.file_handle.close()
+
+
+class NpyImageSource(ImageSource):
+    """A .npy stack, memory-mapped."""
+
+    def __init__(self, path):
+        self.path = path
+        self.array = np.load(path, mmap_mode='r')
+        self.shape = self.array.shape
+        self.dtype = self.array.dtype
+
+    def read(self, ids):
+        return self.array[np.asarray(ids, dtype=np.int64)]
+
+    def __getitem__(self, index):
+        return self.array[index]
+
+    def close(self):
+        self.array = None
+
+
+class DirectoryImageSource(ImageSource):
+    """One .npy file per event; files are ordered by their numeric name, else by name."""
+
+    def __init__(self, path):
+        self.path = path
+        names = [n for n in os.listdir(path) if n.endswith('.npy')]
+        if not names:
+            raise FileNotFoundError(f"No .npy files in {path}")
+        stems = [n[:-4] for n in names]
+        if all(stem.isdigit() for stem in stems):
+            names = [n for _, n in sorted(zip(map(int, stems), names))]
+        else:
+            names = sorted(names)
+        self.files = [os.path.join(path, n) for n in names]
+        first = np.load(self.files[0], mmap_mode='r')
+        self.shape = (len(self.files),) + first.shape
+        self.dtype = first.dtype
+
+    def read(self, ids):
+        out = np.empty((len(ids),) + self.shape[1:], dtype=self.dtype)
+        for i, image_id in enumerate(ids):
+            out[i] = np.load(self.files[image_id])
+        return out
+
+
+class ZarrImageSource(ImageSource):
+    """Array in a zarr store (requires the optional zarr package)."""
+
+    def __init__(self, path, key=None):
+        import zarr
+        store = zarr.open(path, mode='r')
+        self.array = store[key] if key and hasattr(store, 'keys') and key in store else store
+        self.shape = self.array.shape
+        self.dtype = self.array.dtype
+        self.chunk_rows = self.array.chunks[0]
+
+    def read(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        unique, inverse = np.unique(ids, return_inverse=True)
+        return self.array.get_orthogonal_selection(unique)[inverse]
+
+
+def open_image_source(path, key, memmap=True):
+    """Pick a reader for path: zarr store, directory of .npy files, .npy stack or HDF5."""
+    if path.rstrip('/').endswith('.zarr'):
+        return ZarrImageSource(path, key)
+    if os.path.isdir(path):
+        if os.path.exists(os.path.join(path, '.zarray')) or os.path.exists(os.path.join(path, '.zgroup')) \
+                or os.path.exists(os.path.join(path, 'zarr.json')):
+            return ZarrImageSource(path, key)
+        return DirectoryImageSource(path)
+    if path.endswith('.npy'):
+        return NpyImageSource(path)
+    return HDF5ImageSource(path, key, memmap)
+
+
+def chunk_aligned_batches(ids, chunk_rows, batch_size):
+    "Split sorted ids into batches of at most batch_size that avoid splitting a storage chunk."
+    chunks = ids // chunk_rows if chunk_rows else None
+    start = 0
+    while start < len(ids):
+        end = min(start + batch_size, len(ids))
+        if chunks is not None and end < len(ids) and chunks[end - 1] == chunks[end]:
+            first = np.searchsorted(chunks, chunks[end], side='left')
+            # Only back off if the batch still holds at least one whole chunk
+            if first > start:
+                end = first
+        yield ids[start:end]
+        start = end
+
+
+def read_ahead(source, batches, pool, depth):
+    "Yield source.read(batch) for each batch in order, keeping up to depth reads in flight."
+    in_flight = []
+    for batch in batches:
+        in_flight.append(pool.submit(source.read, batch))
+        if len(in_flight) > depth:
+            yield in_flight.pop(0).result()
+    for future in in_flight:
+        yield future.result()
+
+
+def export_shards(source, labels, features, label_names, out_dir, fmt='hdf5',
+                  shard_size=10000, batch_size=1024, compression='lzf', workers=2,
+                  skip_labels=(0,), progress=None):
+    """Stream labelled events into per-class shards of images plus feature rows.
+
+    Events are read in storage order in chunk-aligned batches. Reads run ahead
+    on a thread pool while the previous batch is written, with at most
+    workers + 1 batches held in memory at any time.
+    """
+    labels = np.asarray(labels)
+    n_total = int(np.isin(labels, skip_labels, invert=True).sum())
+    n_done = 0
+    written = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for c in np.unique(labels):
+            if c in skip_labels:
+                continue
+            name = label_names[c] if c < len(label_names) else f"label_{c}"
+            class_dir = os.path.join(out_dir, name.replace(os.sep, '_'))
+            os.makedirs(class_dir, exist_ok=True)
+            class_ids = np.flatnonzero(labels == c)
+            for shard, start in enumerate(range(0, len(class_ids), shard_size)):
+                shard_ids = class_ids[start:start + shard_size]
+                shard_path = os.path.join(class_dir, f"shard_{shard:05d}")
+                shape = (len(shard_ids),) + tuple(source.shape[1:])
+                if fmt == 'npy':
+                    images_out = np.lib.format.open_memmap(
+                        shard_path + '.npy', mode='w+', dtype=source.dtype, shape=shape)
+                    file = None
+                else:
+                    file = h5py.File(shard_path + '.hdf5', 'w')
+                    images_out = file.create_dataset(
+                        'images', shape=shape, dtype=source.dtype, compression=compression,
+                        chunks=(min(len(shard_ids), 64),) + shape[1:])
+                    file.create_dataset('event_id', data=shard_ids)
+                    file.create_dataset('labels', data=label_names)
+                    file.attrs['label'] = int(c)
+                try:
+                    offset = 0
+                    batches = chunk_aligned_batches(shard_ids, source.chunk_rows, batch_size)
+                    for block in read_ahead(source, batches, pool, workers):
+                        images_out[offset:offset + len(block)] = block
+                        offset += len(block)
+                        n_done += len(block)
+                        if progress:
+                            progress(n_done, n_total)
+                finally:
+                    if file is not None:
+                        file.close()
+                    else:
+                        images_out.flush()
+                        del images_out
+                rows = features.iloc[shard_ids]
+                if fmt == 'npy':
+                    np.save(shard_path + '.ids.npy', shard_ids)
+                    np.save(shard_path + '.features.npy', rows.to_records(index=False),
+                            allow_pickle=True)
+                else:
+                    rows.to_hdf(shard_path + '.hdf5', key='features', mode='a')
+                written.append(shard_path)
+    return written
+
+
+def log_progress(task):
+    "Progress callback that logs every 10% of the work."
+    state = {'next': 0.1}
+
+    def report(n_done, n_total):
+        if n_total and n_done / n_total >= state['next']:
+            logger.info(f"{task}: {n_done} / {n_total} ({100 * n_done // n_total}%)")
+            state['next'] = (10 * n_done // n_total + 1) / 10
+    return report
+
+
+def read_memory_status():
+    "Process RSS and system available/total memory in bytes from /proc, or None off Linux."
+    try:
+        with open('/proc/self/status') as file:
+            rss = next(int(line.split()[1]) for line in file if line.startswith('VmRSS:'))
+        meminfo = {}
+        with open('/proc/meminfo') as file:
+            for line in file:
+                key, value = line.split(':', 1)
+                meminfo[key] = int(value.split()[0])
+        return {'rss': rss * 1024, 'available': meminfo['MemAvailable'] * 1024,
+                'total': meminfo['MemTotal'] * 1024}
+    except (OSError, StopIteration, KeyError, ValueError):
+        return None
+
+
+class SessionProfiler:
+    """cProfile and tracemalloc over a stretch of a running session."""
+
+    def __init__(self):
+        self.profile = None
+        self.start_snapshot = None
+        self.started = None
+
+    @property
+    def running(self):
+        return self.profile is not None
+
+    def start(self):
+        tracemalloc.start(25)
+        self.start_snapshot = tracemalloc.take_snapshot()
+        self.profile = cProfile.Profile()
+        self.started = time.time()
+        self.profile.enable()
+
+    def stop(self, path, extra_sections=()):
+        """Stop profiling and write the reports to path (.txt) and the raw stats (.prof)."""
+        self.profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        report = io.StringIO()
+        report.write(f"Profiled {time.time() - self.started:.1f} s\n")
+        for sort in ('cumulative', 'tottime'):
+            report.write(f"\n=== Hotspots by {sort} time ===\n")
+            pstats.Stats(self.profile, stream=report).sort_stats(sort).print_stats(40)
+        report.write("\n=== Top allocations ===\n")
+        for stat in snapshot.statistics('lineno')[:30]:
+            report.write(f"{stat}\n")
+        report.write("\n=== Allocation growth since start ===\n")
+        for stat in snapshot.compare_to(self.start_snapshot, 'lineno')[:30]:
+            report.write(f"{stat}\n")
+        for title, lines in extra_sections:
+            report.write(f"\n=== {title} ===\n")
+            report.writelines(f"{line}\n" for line in lines)
+        self.profile.dump_stats(path.replace('.txt', '.prof'))
+        with open(path, 'w') as file:
+            file.write(report.getvalue())
+        self.profile = None
+        self.start_snapshot = None
+
+
+class TraceRecorder:
+    """Appends timestamped user actions to a JSONL trace for later replay."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a')
+        self.start = time.monotonic()
+
+    def record(self, action, args=()):
+        self.file.write(json.dumps({'t': round(time.monotonic() - self.start, 4),
+                                    'action': action, 'args': list(args)}) + "\n")
+        # One line per user action; flushing keeps the trace intact after a crash
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def load_trace(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def latency_report(latencies):
+    """Per-action count and latency percentiles in milliseconds."""
+    report = {}
+    for action, values in sorted(latencies.items()):
+        values = np.asarray(values) * 1000
+        report[action] = {'n': len(values), 'mean': float(values.mean()),
+                          'p50': float(np.percentile(values, 50)),
+                          'p90': float(np.percentile(values, 90)),
+                          'p99': float(np.percentile(values, 99)),
+                          'max': float(values.max())}
+    return report
+
+
+class BackgroundSignals(QObject):
+    """Signals emitted from worker threads and delivered on the GUI thread."""
+    finished = pyqtSignal()
+    # (event id, channel mode, image) for images that just entered the cache
+    loaded = pyqtSignal(list)
+
+
+class ThumbnailPyramid:
+    """Area-averaged downsampled copies of an image dataset, cached on disk."""
+
+    def __init__(self, path, factors=(2, 4)):
+        self.path = path
+        self.factors = sorted(factors)
+        self.file_handle = None
+        self.levels = {}
+
+    @staticmethod
+    def fingerprint(dataset):
+        """Cheap identity of an image dataset that survives label saves to the same file."""
+        n = dataset.shape[0]
+        sample = dataset[[0, n - 1]] if n > 1 else dataset[:n]
+        return f"{dataset.shape}:{dataset.dtype}:{hashlib.md5(sample.tobytes()).hexdigest()}"
+
+    def is_valid(self, dataset):
+        """Check that a finished pyramid for this exact source exists on disk."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with h5py.File(self.path, 'r') as file:
+                return (file.attrs.get('complete', False)
+                        and file.attrs['source_fingerprint'] == self.fingerprint(dataset)
+                        and all(f'level_{f}' in file for f in self.factors))
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable pyramid {self.path}: {e}")
+            return False
+
+    def open(self):
+        if self.file_handle is None:
+            self.file_handle = h5py.File(self.path, 'r')
+            self.levels = {f: self.file_handle[f'level_{f}'] for f in self.factors}
+
+    def close(self):
+        if self.file_handle is not None:
+            self.file_handle.close()
+            self.file_handle = None
+            self.levels = {}
+
+    def build(self, dataset, batch_bytes=64 * 2**20):
+        """Write all levels in batches, then move the finished file into place."""
+        with atomic_hdf5(self.path) as file:
+            n, h, w = dataset.shape[:3]
+            batch_size = max(1, batch_bytes // (dataset.dtype.itemsize * int(np.prod(dataset.shape[1:]))))
+            levels = {}
+            for f in self.factors:
+                shape = (n, h // f, w // f) + dataset.shape[3:]
+                levels[f] = file.create_dataset(
+                    f'level_{f}', shape=shape, dtype=dataset.dtype,
+                    chunks=(min(n, 256),) + shape[1:])
+            for start in range(0, n, batch_size):
+                block = dataset[start:start + batch_size]
+                previous = 1
+                for f in self.factors:
+                    # Each level is averaged from the previous one
+                    if f % previous == 0:
+                        block = area_downsample(block, f // previous)
+                    else:
+                        block = area_downsample(dataset[start:start + batch_size], f)
+                    levels[f][start:start + len(block)] = block
+                    previous = f
+            file.attrs['source_fingerprint'] = self.fingerprint(dataset)
+            file.attrs['complete'] = True
+
+    def select_level(self, image_shape, tile_size):
+        """Smallest stored level that still covers the displayed tile size."""
+        h, w = image_shape[1:3]
+        factor = 1
+        for f in self.factors:
+            if f in self.levels and min(h // f, w // f) >= tile_size:
+                factor = f
+        return factor
+
+
+class EmbeddingIndex:
+    """Compact per-event embeddings with exact cosine nearest-neighbour search."""
+
+    def __init__(self, n_components=16, thumbnail_size=8, sample_size=20000):
+        self.n_components = n_components
+        self.thumbnail_size = thumbnail_size
+        self.sample_size = sample_size
+        self.embeddings = None
+        self.ready = False
+
+    def _describe(self, images, features):
+        """Raw descriptor per event: a tiny thumbnail plus standardized feature columns."""
+        factor = max(1, min(images.shape[1:3]) // self.thumbnail_size)
+        thumbs = area_downsample(images, factor).astype(np.float32)
+        thumbs = thumbs.reshape(len(images), -1)
+        if np.issubdtype(images.dtype, np.integer):
+            thumbs /= np.iinfo(images.dtype).max
+        if features is None:
+            return thumbs
+        return np.hstack([thumbs, features])
+
+    def build(self, image_dataset, features=None, batch_bytes=64 * 2**20):
+        """Fit PCA on a random sample, then project every event in batches."""
+        n = image_dataset.shape[0]
+        if features is not None:
+            features = np.asarray(features, dtype=np.float32)
+            std = features.std(axis=0)
+            features = (features - features.mean(axis=0)) / np.where(std > 0, std, 1)
+            features = np.nan_to_num(features)
+        batch_size = max(1, batch_bytes // (image_dataset.dtype.itemsize * int(np.prod(image_dataset.shape[1:]))))
+
+        # h5py wants increasing indices for fancy selection
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(n, size=min(n, self.sample_size), replace=False))
+        descriptors = np.vstack([
+            self._describe(image_dataset[sample[i:i + batch_size]],
+                           None if features is None else features[sample[i:i + batch_size]])
+            for i in range(0, len(sample), batch_size)])
+        mean = descriptors.mean(axis=0)
+        _, _, vt = np.linalg.svd(descriptors - mean, full_matrices=False)
+        components = vt[:self.n_components].T
+
+        embeddings = np.empty((n, components.shape[1]), dtype=np.float32)
+        for start in range(0, n, batch_size):
+            end = min(start + batch_size, n)
+            block = self._describe(image_dataset[start:end],
+                                   None if features is None else features[start:end])
+            embeddings[start:end] = (block - mean) @ components
+        # Unit length so a dot product is the cosine similarity
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings /= np.where(norms > 0, norms, 1)
+        self.embeddings = embeddings
+        self.ready = True
+
+    def similarities(self, event_id):
+        return self.embeddings @ self.embeddings[event_id]
+
+    def neighbours(self, event_id, k):
+        """The k events most similar to event_id, nearest first (including itself)."""
+        sims = self.similarities(event_id)
+        k = min(k, len(sims))
+        nearest = np.argpartition(-sims, k - 1)[:k]
+        return nearest[np.argsort(-sims[nearest])]
+
+    def similarity_order(self, event_id):
+        """All event ids sorted by decreasing similarity to event_id."""
+        return np.argsort(-self.similarities(event_id), kind='stable')
+
+
+class ActiveLearner:
+    """Softmax regression on the feature table, retrained in a background thread."""
+
+    def __init__(self, features, n_classes, rare_classes=(), queue_size=5000,
+                 epochs=50, learning_rate=0.5, l2=1e-3, max_train=20000):
+        features = np.asarray(features, dtype=np.float32)
+        std = features.std(axis=0)
+        features = (features - features.mean(axis=0)) / np.where(std > 0, std, 1)
+        # Constant column acts as the bias term
+        self.X = np.hstack([np.nan_to_num(features),
+                            np.ones((len(features), 1), dtype=np.float32)])
+        self.n_classes = n_classes
+        self.rare_classes = list(rare_classes)
+        self.queue_size = queue_size
+        self.epochs = epochs
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.max_train = max_train
+        self.W = np.zeros((self.X.shape[1], n_classes), dtype=np.float32)
+        self.suggested = None
+        self.queue = None
+        self.n_trained = 0
+        self.pending = None
+        self.stopped = False
+        # Guards pending between request_update and the worker
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.signals = BackgroundSignals()
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def request_update(self, labels, reviewed):
+        """Queue a retrain on a snapshot of the labels; never blocks."""
+        # Only the newest snapshot matters, older ones are dropped
+        snapshot = (np.array(labels), np.array(reviewed))
+        with self.lock:
+            self.pending = snapshot
+        self.wakeup.set()
+
+    def shutdown(self):
+        """Let the worker thread exit, releasing the feature matrix."""
+        with self.lock:
+            self.stopped = True
+            self.pending = None
+        self.wakeup.set()
+
+    def _worker(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            with self.lock:
+                if self.stopped:
+                    return
+                request, self.pending = self.pending, None
+            if request is None:
+                continue
+            labels, reviewed = request
+            try:
+                self.train(labels, reviewed)
+                self.predict(labels, reviewed)
+            except Exception as e:
+                logger.error(f"Active learning update failed: {e}")
+                continue
+            if not self.stopped:
+                self.signals.finished.emit()
+
+    def _softmax(self, X):
+        z = X @ self.W
+        z -= z.max(axis=1, keepdims=True)
+        np.exp(z, out=z)
+        z /= z.sum(axis=1, keepdims=True)
+        return z
+
+    def train(self, labels, reviewed):
+        """Continue gradient descent from the previous weights."""
+        # Reviewed events left at 0 count as class 0 examples
+        train_ids = np.flatnonzero((labels != 0) | reviewed)
+        if len(train_ids) == 0 or len(np.unique(labels[train_ids])) < 2:
+            return
+        if len(train_ids) > self.max_train:
+            train_ids = np.random.default_rng().choice(train_ids, self.max_train, replace=False)
+        X = self.X[train_ids]
+        Y = np.eye(self.n_classes, dtype=np.float32)[labels[train_ids]]
+        for _ in range(self.epochs):
+            grad = X.T @ (self._softmax(X) - Y) / len(X) + self.l2 * self.W
+            self.W -= self.learning_rate * grad
+        self.n_trained = len(train_ids)
+
+    def predict(self, labels, reviewed, batch_size=2**18):
+        """Suggested label for every event and a priority queue of unreviewed ones."""
+        n = len(self.X)
+        suggested = np.empty(n, dtype=np.uint8)
+        priority = np.empty(n, dtype=np.float32)
+        for start in range(0, n, batch_size):
+            probs = self._softmax(self.X[start:start + batch_size])
+            suggested[start:start + batch_size] = probs.argmax(axis=1)
+            # Uncertain events and likely rare ones come first
+            score = 1 - probs.max(axis=1)
+            if self.rare_classes:
+                score = np.maximum(score, probs[:, self.rare_classes].max(axis=1))
+            priority[start:start + batch_size] = score
+        priority[(labels != 0) | reviewed] = -1
+        k = min(self.queue_size, n)
+        top = np.argpartition(-priority, k - 1)[:k]
+        top = top[np.argsort(-priority[top])]
+        self.queue = top[priority[top] >= 0]
+        self.suggested = suggested
+
+
+class LabelStatistics:
+    """Per-class label counts kept up to date incrementally."""
+
+    def __init__(self, labels, n_classes, check_interval=1000):
+        self.n_classes = n_classes
+        self.check_interval = check_interval
+        self.n_events = len(labels)
+        self.counts = np.bincount(labels, minlength=n_classes).astype(np.int64)
+        self.updates_since_check = 0
+
+    def update(self, old_labels, new_label):
+        """Account for a batch of events changing from old_labels to new_label."""
+        np.subtract.at(self.counts, old_labels, 1)
+        self.counts[new_label] += len(old_labels)
+        self.updates_since_check += 1
+
+    def needs_check(self):
+        return self.updates_since_check >= self.check_interval
+
+    def check(self, labels):
+        """Recount from scratch and repair any drift."""
+        counts = np.bincount(labels, minlength=len(self.counts)).astype(np.int64)
+        if not np.array_equal(counts, self.counts):
+            logger.warning("Label statistics drifted from the label column, recounted")
+            self.counts = counts
+        self.updates_since_check = 0
+
+    def unlabelled(self):
+        return int(self.counts[0])
+
+
+def sidecar_path(source_path, kind, annotator, directory=None):
+    """<file>.<kind>.<annotator>.hdf5, in directory or next to the source file."""
+    directory = directory or os.path.dirname(os.path.abspath(source_path))
+    name = os.path.basename(source_path).replace('.hdf5', '')
+    return os.path.join(directory, f"{name}.{kind}.{annotator}.hdf5")
+
+
+@contextmanager
+def atomic_hdf5(path):
+    """Write a new HDF5 file under a temporary name and swap it in once complete.
+
+    Readers never see a partial file.
+    """
+    tmp_path = path + '.tmp'
+    with h5py.File(tmp_path, 'w') as file:
+        yield file
+    os.replace(tmp_path, path)
+
+
+class LabelSidecar:
+    """One annotator's labels for a source file, stored outside the source file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        """Return (labels, label names, annotator)."""
+        with h5py.File(self.path, 'r') as file:
+            names = [n.decode() if isinstance(n, bytes) else n for n in file['labels'][()]]
+            return file['label'][()], names, file.attrs.get('annotator', '')
+
+    def save(self, labels, label_names, annotator, source_path):
+        with atomic_hdf5(self.path) as file:
+            file.create_dataset('label', data=np.asarray(labels), compression='gzip',
+                                chunks=(min(len(labels), 2**20),) if len(labels) else None)
+            file.create_dataset('labels', data=label_names)
+            file.attrs['annotator'] = annotator
+            file.attrs['source'] = os.path.abspath(source_path)
+            file.attrs['saved_at'] = time.time()
+
+
+class FeatureCompaction:
+    """How a features table was compacted, so the original can be written back."""
+
+    def __init__(self, dtypes, lossy, bytes_before, bytes_after):
+        # Original dtype of every column that was changed
+        self.dtypes = dtypes
+        # Columns downcast within a tolerance; their exact values are reread on save
+        self.lossy = lossy
+        self.bytes_before = bytes_before
+        self.bytes_after = bytes_after
+
+    def restore(self, frame, source_path, data_key):
+        """Copy of frame with the stored dtypes and values."""
+        restored = frame.copy()
+        for column, dtype in self.dtypes.items():
+            if column not in self.lossy:
+                restored[column] = restored[column].astype(dtype)
+        if self.lossy:
+            original = pd.read_hdf(source_path, data_key)
+            if len(original) != len(restored):
+                raise ValueError(f"{source_path} changed since it was loaded, "
+                                 f"cannot restore columns {self.lossy}")
+            for column in self.lossy:
+                restored[column] = original[column].to_numpy()
+        return restored
+
+
+def compact_features(frame, tolerance=0.0, skip=('label',)):
+    """Downcast numeric columns and encode repetitive strings as categoricals, in place.
+
+    Floats become float32 when that is exact, or when the relative error stays within
+    tolerance. Integers take the smallest type that holds their range.
+    """
+    bytes_before = int(frame.memory_usage(deep=True).sum())
+    dtypes, lossy = {}, []
+    for column in frame.columns:
+        if column in skip:
+            continue
+        values = frame[column]
+        dtype = values.dtype
+        if pd.api.types.is_bool_dtype(dtype):
+            continue
+        if pd.api.types.is_integer_dtype(dtype):
+            downcast = 'unsigned' if len(values) and values.min() >= 0 else 'integer'
+            compacted = pd.to_numeric(values, downcast=downcast)
+        elif pd.api.types.is_float_dtype(dtype) and dtype.itemsize > 4:
+            array = values.to_numpy()
+            single = array.astype(np.float32)
+            if np.array_equal(single.astype(dtype), array, equal_nan=True):
+                compacted = pd.Series(single, index=values.index)
+            elif tolerance > 0:
+                with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+                    error = np.abs(single - array) / np.abs(array)
+                error = error[np.isfinite(array) & (array != 0)]
+                if (np.isfinite(single) == np.isfinite(array)).all() and \
+                        (len(error) == 0 or error.max() <= tolerance):
+                    compacted = pd.Series(single, index=values.index)
+                    lossy.append(column)
+                else:
+                    continue
+            else:
+                continue
+        elif pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype):
+            if values.nunique() > len(values) // 2:
+                continue
+            compacted = values.astype('category')
+        else:
+            continue
+        if compacted.dtype != dtype:
+            frame[column] = compacted
+            dtypes[column] = dtype
+    bytes_after = int(frame.memory_usage(deep=True).sum())
+    return FeatureCompaction(dtypes, lossy, bytes_before, bytes_after)
+
+
+class AnnotationJournal:
+    """Timestamped record of every label change, buffered in memory and appended to HDF5."""
+
+    dtype = np.dtype([('event', np.int64), ('old', np.int16), ('new', np.int16),
+                      ('time', np.float64), ('page', np.int32)])
+
+    def __init__(self, path, buffer_size=4096):
+        self.path = path
+        self.chunk_rows = buffer_size
+        self.buffer = np.zeros(buffer_size, dtype=self.dtype)
+        self.n_buffered = 0
+
+    def record(self, ids, old_labels, new_label, page):
+        """Add one row per event whose label actually changed."""
+        changed = old_labels != new_label
+        ids, old_labels = ids[changed], old_labels[changed]
+        now = time.time()
+        start = 0
+        while start < len(ids):
+            if self.n_buffered == len(self.buffer) and not self.flush():
+                # Keep every row in memory until the file can be written again
+                self.buffer = np.concatenate([self.buffer, np.zeros_like(self.buffer)])
+            n = min(len(ids) - start, len(self.buffer) - self.n_buffered)
+            rows = self.buffer[self.n_buffered:self.n_buffered + n]
+            rows['event'] = ids[start:start + n]
+            rows['old'] = old_labels[start:start + n]
+            rows['new'] = new_label
+            rows['time'] = now
+            rows['page'] = page
+            self.n_buffered += n
+            start += n
+
+    def flush(self):
+        """Append the buffered rows to the journal file; False if it could not be written."""
+        if self.n_buffered == 0:
+            return True
+        try:
+            with h5py.File(self.path, 'a') as file:
+                if 'journal' not in file:
+                    file.create_dataset('journal', shape=(0,), maxshape=(None,), dtype=self.dtype,
+                                        chunks=(self.chunk_rows,), compression='gzip')
+                dataset = file['journal']
+                dataset.resize((len(dataset) + self.n_buffered,))
+                dataset[-self.n_buffered:] = self.buffer[:self.n_buffered]
+        except OSError as e:
+            logger.error(f"Could not write journal {self.path}, keeping "
+                         f"{self.n_buffered} rows in memory: {e}")
+            return False
+        logger.debug(f"Flushed {self.n_buffered} journal rows to {self.path}")
+        self.n_buffered = 0
+        return True
+
+    def load(self):
+        """All rows, flushed and buffered, in time order."""
+        rows = self.buffer[:self.n_buffered]
+        if os.path.exists(self.path):
+            with h5py.File(self.path, 'r') as file:
+                if 'journal' in file:
+                    rows = np.concatenate([file['journal'][()], rows])
+        return rows
+
+
+def journal_report(rows, n_classes, idle=300.0):
+    """Labels per minute, time per page and per-class relabel rates from journal rows.
+
+    Gaps longer than idle seconds count as breaks and are left out of working time.
+    """
+    rows = np.sort(rows, order='time', kind='stable')
+    report = {'n_changes': len(rows), 'n_events': int(len(np.unique(rows['event'])))}
+    if len(rows) == 0:
+        return report
+    gaps = np.diff(rows['time'])
+    active = float(gaps[gaps <= idle].sum())
+    report['active_minutes'] = active / 60
+    report['labels_per_minute'] = len(rows) / (active / 60) if active > 0 else float('nan')
+    # A page visit starts with its first change and ends with the first change on the next page
+    visit_starts = np.flatnonzero(np.r_[True, rows['page'][1:] != rows['page'][:-1]])
+    visit_times = np.diff(rows['time'][visit_starts])
+    visit_times = visit_times[visit_times <= idle]
+    if len(visit_times):
+        report['seconds_per_page'] = {'mean': float(visit_times.mean()),
+                                      'median': float(np.median(visit_times))}
+    # A change is relabelled if the same event changes again later
+    order = np.lexsort((rows['time'], rows['event']))
+    events = rows['event'][order]
+    relabelled = np.r_[events[1:] == events[:-1], False]
+    new = rows['new'][order].astype(np.int64)
+    assigned = np.bincount(new, minlength=n_classes)
+    changed_later = np.bincount(new[relabelled], minlength=n_classes)
+    report['relabel_rate'] = {int(c): float(changed_later[c] / assigned[c])
+                              for c in range(len(assigned)) if assigned[c]}
+    return report
+
+
+def log_journal_report(report, label_names=()):
+    logger.info(f"{report['n_changes']} label changes on {report['n_events']} events")
+    if 'labels_per_minute' not in report:
+        return
+    logger.info(f"Active time {report['active_minutes']:.1f} min, "
+                f"{report['labels_per_minute']:.1f} labels/min")
+    if 'seconds_per_page' in report:
+        logger.info(f"Time per page: mean {report['seconds_per_page']['mean']:.1f} s, "
+                    f"median {report['seconds_per_page']['median']:.1f} s")
+    for c, rate in report['relabel_rate'].items():
+        name = label_names[c] if c < len(label_names) else c
+        logger.info(f"{name:>12}: relabelled {100 * rate:6.2f}%")
+
+
+class SessionState:
+    """Where an annotator left off in a file: page, grid, channels, order and hot cache ids."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        with h5py.File(self.path, 'r') as file:
+            return {'n_events': int(file.attrs['n_events']),
+                    'page': int(file.attrs['page']),
+                    'grid': tuple(int(v) for v in file.attrs['grid']),
+                    'channels': [c.decode() if isinstance(c, bytes) else c
+                                 for c in file.attrs['channels']],
+                    'nav_name': file.attrs['nav_name'],
+                    'nav_order': file['nav_order'][()] if 'nav_order' in file else None,
+                    'hot_ids': file['hot_ids'][()]}
+
+    def save(self, n_events, page, grid, channels, nav_name, nav_order, hot_ids):
+        with atomic_hdf5(self.path) as file:
+            file.attrs['n_events'] = n_events
+            file.attrs['page'] = page
+            file.attrs['grid'] = grid
+            file.attrs['channels'] = channels
+            file.attrs['nav_name'] = nav_name
+            file.attrs['saved_at'] = time.time()
+            if nav_order is not None:
+                file.create_dataset('nav_order', data=nav_order, compression='gzip')
+            file.create_dataset('hot_ids', data=np.asarray(hot_ids, dtype=np.int64))
+
+
+def stratified_sample(labels, block_rows, classes, count=None, fraction=None, per_block=8,
+                      seed=None):
+    """Per-class sample of event ids, drawn as small clusters from storage blocks.
+
+    For each class, blocks of block_rows consecutive ids are visited in random order,
+    and up to per_block of the class's events are drawn from each, until the class
+    has count events (or fraction of them). Events close together in storage are then
+    read together. Returns ids, strata and Horvitz-Thompson weights (inverse inclusion
+    probabilities) so estimates stay unbiased despite the clustering.
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.asarray(labels)
+    ids, strata, weights = [], [], []
+    for c in classes:
+        class_ids = np.flatnonzero(labels == c)
+        target = count if count is not None else int(np.ceil(fraction * len(class_ids)))
+        target = min(target, len(class_ids))
+        if target == 0:
+            continue
+        # class_ids is sorted, so each block's members are a contiguous slice
+        _, starts, sizes = np.unique(class_ids // block_rows, return_index=True,
+                                     return_counts=True)
+        picked = []
+        taken = 0
+        for b in rng.permutation(len(starts)):
+            if taken == target:
+                break
+            k = min(per_block, sizes[b], target - taken)
+            members = class_ids[starts[b]:starts[b] + sizes[b]]
+            picked.append((rng.choice(members, k, replace=False), sizes[b] / k))
+            taken += k
+        # Block inclusion probability times within-block probability
+        block_weight = len(starts) / len(picked)
+        for chosen, within_weight in picked:
+            ids.append(chosen)
+            strata.append(np.full(len(chosen), c, dtype=np.int16))
+            weights.append(np.full(len(chosen), block_weight * within_weight))
+    if not ids:
+        return np.zeros(0, np.int64), np.zeros(0, np.int16), np.zeros(0)
+    ids, strata, weights = np.concatenate(ids), np.concatenate(strata), np.concatenate(weights)
+    # Class by class, in storage order within a class
+    order = np.lexsort((ids, strata))
+    return ids[order].astype(np.int64), strata[order], weights[order]
+
+
+class ReviewSidecar:
+    """A QA review: the sampled events, their design weights and the reviewer's verdicts.
+
+    Kept apart from the labels; the reviewed labels themselves are never changed.
+    """
+
+    def __init__(self, path, ids, strata, weights, review_label=None, reviewed=None):
+        self.path = path
+        self.ids = ids
+        self.strata = strata
+        self.weights = weights
+        # Label the reviewer gave, -1 where they left the original label
+        self.review_label = (np.full(len(ids), -1, dtype=np.int16)
+                             if review_label is None else review_label)
+        self.reviewed = np.zeros(len(ids), dtype=bool) if reviewed is None else reviewed
+        self.index = {int(id): i for i, id in enumerate(ids)}
+
+    @classmethod
+    def load(cls, path):
+        with h5py.File(path, 'r') as file:
+            return cls(path, file['ids'][()], file['strata'][()], file['weights'][()],
+                       file['review_label'][()], file['reviewed'][()])
+
+    def save(self, reviewer, source_path):
+        with atomic_hdf5(self.path) as file:
+            for key in ('ids', 'strata', 'weights', 'review_label', 'reviewed'):
+                file.create_dataset(key, data=getattr(self, key))
+            file.attrs['reviewer'] = reviewer
+            file.attrs['source'] = os.path.abspath(source_path)
+            file.attrs['saved_at'] = time.time()
+
+    def positions(self, ids):
+        return np.array([self.index[int(id)] for id in ids if int(id) in self.index], dtype=np.int64)
+
+    def label_of(self, id):
+        """Label to show for a sampled event: the reviewer's, else the original."""
+        i = self.index.get(int(id))
+        if i is None:
+            return None
+        return int(self.review_label[i]) if self.review_label[i] >= 0 else int(self.strata[i])
+
+    def set_labels(self, ids, label):
+        positions = self.positions(ids)
+        self.review_label[positions] = label
+        self.reviewed[positions] = True
+
+    def mark_reviewed(self, ids):
+        self.reviewed[self.positions(ids)] = True
+
+    def report(self):
+        """Per class: sampled, reviewed and weighted share confirmed by the reviewer."""
+        agree = (self.review_label < 0) | (self.review_label == self.strata)
+        report = {}
+        for c in np.unique(self.strata):
+            in_class = self.strata == c
+            done = in_class & self.reviewed
+            weight = self.weights[done].sum()
+            report[int(c)] = {'sampled': int(in_class.sum()), 'reviewed': int(done.sum()),
+                              'agreement': float((self.weights[done] * agree[done]).sum() / weight)
+                              if weight > 0 else float('nan')}
+        return report
+
+
+def merge_label_sidecars(paths, n_classes=None):
+    """Majority-vote consensus over several sidecars, with agreement statistics."""
+    loaded = [LabelSidecar(path).load() for path in paths]
+    labels = np.stack([item[0] for item in loaded])
+    n_annotators, n_events = labels.shape
+    names = max((item[1] for item in loaded), key=len)
+    n_classes = n_classes or max(len(names), int(labels.max()) + 1)
+
+    # votes[c, i]: number of annotators who gave event i label c
+    votes = np.zeros((n_classes, n_events), dtype=np.uint16)
+    for c in range(n_classes):
+        votes[c] = (labels == c).sum(axis=0)
+    # Ties go to the lower label id
+    consensus = votes.argmax(axis=0).astype(labels.dtype)
+    support = votes.max(axis=0)
+
+    report = {'annotators': [item[2] for item in loaded], 'n_events': n_events,
+              'unanimous': float((support == n_annotators).mean()), 'classes': {}}
+    if n_annotators > 1:
+        # Fleiss' kappa
+        p_event = ((votes.astype(np.float64) ** 2).sum(axis=0) - n_annotators) \
+            / (n_annotators * (n_annotators - 1))
+        p_class = votes.sum(axis=1) / (n_events * n_annotators)
+        p_expected = (p_class ** 2).sum()
+        report['kappa'] = float((p_event.mean() - p_expected) / (1 - p_expected)) \
+            if p_expected < 1 else 1.0
+    for c in range(n_classes):
+        anyone = int((votes[c] > 0).sum())
+        if anyone == 0:
+            continue
+        report['classes'][names[c] if c < len(names) else f"label_{c}"] = {
+            'consensus': int((consensus == c).sum()),
+            'any': anyone,
+            # Events everyone gave this label, out of those anyone did
+            'agreement': float((votes[c] == n_annotators).sum() / anyone)}
+    return consensus, support, names, report
+
+
+class NavigationTracker:
+    """Direction and speed of page turns, used to size the prefetch lookahead."""
+
+    def __init__(self, max_depth=1, window=1.0):
+        self.max_depth = max_depth
+        # Page turns in the current direction within the last window seconds
+        self.window = window
+        self.turns = deque()
+        self.direction = 0
+
+    def record(self, direction):
+        """Register a page turn; returns True if the direction reversed."""
+        now = time.monotonic()
+        reversed_ = self.direction != 0 and direction != self.direction
+        if reversed_:
+            self.turns.clear()
+        self.direction = direction
+        self.turns.append(now)
+        while now - self.turns[0] > self.window:
+            self.turns.popleft()
+        return reversed_
+
+    def depth(self):
+        """Pages to read ahead: one when browsing, up to max_depth when holding a key."""
+        return max(1, min(self.max_depth, len(self.turns)))
+
+
 class ImageCacheManager:
     """Manages dynamic loading and caching of images for memory efficiency."""
     
-    def __init__(self, file_path, image_key, cache_size=50):
+    def __init__(self, file_path, image_key, cache_size=50, memmap=True):
         self.file_path = file_path
         self.image_key = image_key
         self.cache_size = cache_size
+        # Upper bound for adaptive sizing; cache_size shrinks below it under pressure
+        self.max_cache_size = cache_size
+        self.memmap = memmap
         self.cache = OrderedDict()
-        self.file_handle = None
-        self.image_dataset = None
+        # ImageSource backend, see open_image_source
+        self.source = None
         self.image_shape = None
         self.n_events = 0
         self.selected_channels = ['composite']  # Default to composite view
+        # Views may need more tiles on screen than cache_size allows
+        self.min_capacity = 0
+        # Guards the cache and file handle against the prefetch thread
+        self.lock = threading.RLock()
+        self.prefetch_queue = queue.Queue()
+        self.prefetch_generation = 0
+        self.prefetch_thread = None
+        # Ids of the last prefetch request, see prefetch(keep_pending=True)
+        self.pending_prefetch = []
+        # Ids shown as placeholders, read before anything else until they arrive
+        self.required_ids = []
+        self.signals = BackgroundSignals()
+        # Displayed pages that were already cached when the user reached them
+        self.hits = 0
+        self.misses = 0
+        # Downsampled levels; reads come from the pyramid once it is ready
+        self.pyramid = None
+        self.level = 1
+        self.display_size = None
         
     def open_file(self):
-        """Open the HDF5 file and get image dataset reference."""
-        if self.file_handle is None:
-            self.file_handle = h5py.File(self.file_path, 'r')
-            self.image_dataset = self.file_handle[self.image_key]
-            self.image_shape = self.image_dataset.shape
-            self.n_events = self.image_shape[0]
-            logger.info(f"Opened file with {self.n_events} images")
+        """Open the image source."""
+        with self.lock:
+            if self.source is None:
+                self.source = open_image_source(self.file_path, self.image_key, self.memmap)
+                self.image_shape = self.source.shape
+                self.n_events = self.image_shape[0]
+                logger.info(f"Opened {type(self.source).__name__} with {self.n_events} images")
+                if self.pyramid is not None and self.pyramid.is_valid(self.source):
+                    self.pyramid.open()
+                    self.select_level()
     
     def close_file(self):
-        """Close the HDF5 file."""
-        if self.file_handle is not None:
-            self.file_handle.close()
-            self.file_handle = None
-            self.image_dataset = None
+        """Close the image source."""
+        with self.lock:
+            if self.source is not None:
+                self.source.close()
+                self.source = None
+            if self.pyramid is not None:
+                self.pyramid.close()
+
+    def enable_pyramid(self, path, factors=(2, 4)):
+        """Use a thumbnail pyramid at path, building it in the background if needed."""
+        self.open_file()
+        self.pyramid = ThumbnailPyramid(path, factors)
+        if self.pyramid.is_valid(self.source):
+            with self.lock:
+                self.pyramid.open()
+                self.select_level()
+            return
+        threading.Thread(target=self._build_pyramid, args=(self.pyramid,), daemon=True).start()
+
+    def _build_pyramid(self, pyramid):
+        logger.info(f"Building thumbnail pyramid {pyramid.path}")
+        try:
+            source = open_image_source(self.file_path, self.image_key, self.memmap)
+            try:
+                pyramid.build(source)
+            finally:
+                source.close()
+        except Exception as e:
+            logger.error(f"Error building thumbnail pyramid: {e}")
+            return
+        with self.lock:
+            if self.pyramid is pyramid and self.source is not None:
+                pyramid.open()
+                self.select_level()
+        logger.info("Thumbnail pyramid ready")
+
+    def set_display_size(self, tile_size):
+        """Tell the cache how large tiles are drawn so it can pick a pyramid level."""
+        with self.lock:
+            self.display_size = tile_size
+            self.select_level()
+
+    def select_level(self):
+        with self.lock:
+            level = 1
+            if self.pyramid is not None and self.display_size and self.image_shape is not None:
+                level = self.pyramid.select_level(self.image_shape, self.display_size)
+            if level != self.level:
+                self.level = level
+                # Cached tiles were rendered at the previous resolution
+                self.cache.clear()
+                logger.info(f"Reading images at 1/{level} resolution")
     
     def _to_rgb888(self, image_data, channel_mode='composite'):
         """Convert various image shapes/dtypes to contiguous uint8 RGB (H, W, 3)."""
@@ -142,96 +1338,488 @@ class ImageCacheManager:
 
     def set_selected_channels(self, channels):
         """Set which channels to display."""
-        self.selected_channels = channels
-        # Clear cache when channel selection changes
-        self.cache.clear()
+        with self.lock:
+            self.selected_channels = channels
+            # Clear cache when channel selection changes
+            self.cache.clear()
 
     def get_image(self, image_id, channel_mode='composite'):
         """Get image by ID with caching."""
-        # Ensure file is open and n_events initialized
-        self.open_file()
-        if image_id >= self.n_events:
-            return None
+        with self.lock:
+            # Ensure file is open and n_events initialized
+            self.open_file()
+            if image_id >= self.n_events:
+                return None
+                
+            # Create cache key that includes channel mode
+            cache_key = f"{image_id}_{channel_mode}"
             
-        # Create cache key that includes channel mode
-        cache_key = f"{image_id}_{channel_mode}"
-        
-        # Check cache first
-        if cache_key in self.cache:
-            # Move to end (most recently used)
-            self.cache.move_to_end(cache_key)
-            return self.cache[cache_key]
-        
-        # Load from file
-        image_data = self.image_dataset[image_id]
-        
-        # Convert to contiguous RGB888 with specified channel mode
-        image_data = self._to_rgb888(image_data, channel_mode)
-        
+            # Check cache first
+            if cache_key in self.cache:
+                # Move to end (most recently used)
+                self.cache.move_to_end(cache_key)
+                return self.cache[cache_key]
+            
+            # Load from file, using the smallest adequate pyramid level
+            if self.level > 1:
+                image_data = self.pyramid.levels[self.level][image_id]
+            else:
+                image_data = self.source[image_id]
+            
+            # Convert to contiguous RGB888 with specified channel mode
+            image_data = self._to_rgb888(image_data, channel_mode)
+            self._store(cache_key, image_data)
+            return image_data
+
+    def _store(self, cache_key, image_data):
         # Add to cache
         self.cache[cache_key] = image_data
-        
+        self._evict()
+
+    def _evict(self):
         # Evict oldest if cache is full
-        if len(self.cache) > self.cache_size:
+        while len(self.cache) > max(self.cache_size, self.min_capacity):
             self.cache.popitem(last=False)
-        
-        return image_data
+
+    def adapt_to_memory(self, status, low=0.10, high=0.25, rss_limit=None, min_size=16):
+        """Shrink the cache when memory runs short and grow it back when it frees up."""
+        available = status['available'] / status['total']
+        with self.lock:
+            old_size = self.cache_size
+            if available < low or (rss_limit and status['rss'] > rss_limit):
+                self.cache_size = max(min_size, self.cache_size // 2)
+            elif available > high and self.cache_size < self.max_cache_size:
+                self.cache_size = min(self.max_cache_size, self.cache_size * 5 // 4 + 1)
+            if self.cache_size != old_size:
+                self._evict()
+                logger.info(f"Image cache resized {old_size} -> {self.cache_size} "
+                            f"(available {100 * available:.1f}%, RSS {status['rss'] // 2**20} MB)")
+
+    def read_images(self, ids):
+        """Raw images for a batch of ids at the current pyramid level."""
+        with self.lock:
+            self.open_file()
+            if self.level > 1:
+                return read_rows(self.pyramid.levels[self.level], ids)
+            return self.source.read(ids)
     
     def preload_range(self, start_id, end_id):
         """Preload a range of images for better performance."""
         for i in range(start_id, min(end_id, self.n_events)):
             if i not in self.cache:
                 self.get_image(i)
+
+    def preload_ids(self, ids, channels=None):
+        """Load the given images in all displayed channels with one batched read."""
+        with self.lock:
+            self.open_file()
+            channels = list(channels or self.selected_channels)
+            missing = [i for i in ids if i < self.n_events
+                       and any(f"{i}_{mode}" not in self.cache for mode in channels)]
+            if not missing:
+                return
+            for image_id, image_data in zip(missing, self.read_images(missing)):
+                for channel_mode in channels:
+                    self._store(f"{image_id}_{channel_mode}",
+                                self._to_rgb888(image_data, channel_mode))
+
+    def count_hits(self, ids):
+        """Record how many of the ids about to be shown are already cached."""
+        with self.lock:
+            mode = self.selected_channels[0]
+            hits = sum(f"{i}_{mode}" in self.cache for i in ids)
+            self.hits += hits
+            self.misses += len(ids) - hits
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def hot_ids(self):
+        """Cached event ids, most recently used first."""
+        with self.lock:
+            keys = list(self.cache.keys())
+        ids = (int(key.split('_', 1)[0]) for key in reversed(keys))
+        return list(dict.fromkeys(ids))
+
+    def peek(self, image_id, channel_mode='composite'):
+        """Cached image, or None without reading anything."""
+        with self.lock:
+            return self.cache.get(f"{image_id}_{channel_mode}")
+
+    def prefetch(self, ids, keep_pending=False):
+        """Load images in a background thread, replacing any pending request.
+
+        With keep_pending the ids go first and the previous request follows them.
+        """
+        ids = list(ids)
+        with self.lock:
+            if keep_pending:
+                ids += self.pending_prefetch
+            # Read-ahead never displaces tiles the screen is waiting for
+            ids = list(dict.fromkeys(self.required_ids + ids))
+            self.pending_prefetch = ids
+            self.prefetch_generation += 1
+            if self.prefetch_thread is None or not self.prefetch_thread.is_alive():
+                self.prefetch_queue = queue.Queue()
+                self.prefetch_thread = threading.Thread(
+                    target=self._prefetch_worker, args=(self.prefetch_queue,), daemon=True)
+                self.prefetch_thread.start()
+            self.prefetch_queue.put((self.prefetch_generation, ids))
+
+    def require(self, ids):
+        """Read these ids first, in this and every later prefetch, until they are cached."""
+        with self.lock:
+            self.required_ids = list(dict.fromkeys(ids))
+            if self.required_ids:
+                self.prefetch([], keep_pending=True)
+
+    def cancel_prefetch(self):
+        """Drop whatever is left of the pending prefetch request."""
+        with self.lock:
+            self.prefetch_generation += 1
+            self.pending_prefetch = []
+            self.required_ids = []
+
+    def _prefetch_worker(self, requests):
+        """Serve prefetch requests until close() sends None."""
+        while True:
+            request = requests.get()
+            if request is None:
+                return
+            generation, ids = request
+            # Small batches keep the lock free for the GUI thread in between
+            for start in range(0, len(ids), 16):
+                # A newer request supersedes whatever is left of this one
+                if generation != self.prefetch_generation:
+                    break
+                try:
+                    batch = ids[start:start + 16]
+                    self.preload_ids(batch)
+                    with self.lock:
+                        done = set(batch)
+                        self.required_ids = [i for i in self.required_ids if i not in done]
+                        # Hand the images over directly; they may be evicted before the GUI looks
+                        tiles = [(i, mode, self.cache.get(f"{i}_{mode}"))
+                                 for i in batch for mode in self.selected_channels]
+                    self.signals.loaded.emit(tiles)
+                except Exception as e:
+                    logger.debug(f"Prefetch of events {ids[start:start + 16]} failed: {e}")
     
     def clear_cache(self):
         """Clear the image cache to free memory."""
-        self.cache.clear()
+        with self.lock:
+            self.cache.clear()
         logger.info("Image cache cleared")
 
+    def close(self):
+        """Stop the prefetch thread, drop the cache and close the file, for good."""
+        with self.lock:
+            self.cancel_prefetch()
+            if self.prefetch_thread is not None:
+                # The worker holds this manager until it sees the sentinel
+                self.prefetch_queue.put(None)
+                self.prefetch_thread = None
+            self.cache.clear()
+            self.close_file()
+
+
+def tile_server_key(socket_path, key_path=None, create=False):
+    """Shared secret that tile server clients must prove they know.
+
+    Kept in key_path (default: next to the socket). The server creates it readable by
+    owner and group only, so access is granted by group membership.
+    """
+    key_path = key_path or socket_path + '.key'
+    if create and not os.path.exists(key_path):
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o640)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(os.urandom(32).hex().encode())
+        logger.info(f"Created tile server key {key_path}")
+    with open(key_path, 'rb') as file:
+        return file.read().strip()
+
+
+class TileServer:
+    """Serves rendered tiles from one shared cache to GUI clients over a Unix socket.
+
+    Clients must know the key in key_path, and may only open files under roots.
+    """
+
+    def __init__(self, socket_path, cache_size=20000, memmap=True, key_path=None, roots=None):
+        self.socket_path = socket_path
+        self.cache_size = cache_size
+        self.memmap = memmap
+        self.authkey = tile_server_key(socket_path, key_path, create=True)
+        self.roots = [os.path.realpath(root) for root in (roots or [os.getcwd()])]
+        # One cache per (file, image key), shared by every client
+        self.managers = {}
+        # Clients that have read through each manager since it was last closed
+        self.readers = {}
+        self.lock = threading.Lock()
+
+    def manager(self, path, image_key):
+        path = os.path.realpath(path)
+        if not any(os.path.commonpath([path, root]) == root for root in self.roots):
+            raise PermissionError(f"{path} is outside the served directories")
+        with self.lock:
+            key = (path, image_key)
+            if key not in self.managers:
+                self.managers[key] = ImageCacheManager(key[0], image_key, self.cache_size,
+                                                       memmap=self.memmap)
+                self.readers[key] = set()
+                logger.info(f"Serving {image_key} from {key[0]}")
+            return key, self.managers[key]
+
+    def handle(self, request, client):
+        command, path, image_key = request[:3]
+        key, manager = self.manager(path, image_key)
+        if command == 'close':
+            with self.lock:
+                readers = self.readers[key]
+                readers.discard(client)
+                if readers:
+                    # Closing under them would let their next read reopen the file mid-write
+                    raise RuntimeError(f"{len(readers)} other client(s) are reading {key[0]}")
+                # Release the file so the client can write to it in place
+                manager.close_file()
+            return None
+        with self.lock:
+            self.readers[key].add(client)
+        if command == 'open':
+            manager.open_file()
+            return manager.image_shape
+        if command == 'tiles':
+            ids, channel_mode = request[3:]
+            with manager.lock:
+                manager.preload_ids(ids, [channel_mode])
+                return [manager.get_image(i, channel_mode) for i in ids]
+        raise ValueError(f"Unknown tile server command: {command}")
+
+    def serve_client(self, connection):
+        client = id(connection)
+        with connection:
+            try:
+                while True:
+                    try:
+                        request = connection.recv()
+                    except EOFError:
+                        return
+                    try:
+                        connection.send(('ok', self.handle(request, client)))
+                    except Exception as e:
+                        connection.send(('error', f"{type(e).__name__}: {e}"))
+            finally:
+                with self.lock:
+                    for readers in self.readers.values():
+                        readers.discard(client)
+
+    def remove_stale_socket(self):
+        """Remove a socket left behind by a server that is no longer running."""
+        if not os.path.lexists(self.socket_path):
+            return
+        if not stat.S_ISSOCK(os.lstat(self.socket_path).st_mode):
+            raise FileExistsError(f"{self.socket_path} exists and is not a socket")
+        probe = socket.socket(socket.AF_UNIX)
+        try:
+            probe.connect(self.socket_path)
+        except ConnectionRefusedError:
+            os.remove(self.socket_path)
+            return
+        finally:
+            probe.close()
+        raise FileExistsError(f"A tile server is already listening on {self.socket_path}")
+
+    def serve_forever(self):
+        self.remove_stale_socket()
+        # Owner and group only, from the moment the socket is bound
+        old_umask = os.umask(0o117)
+        try:
+            listener = Listener(self.socket_path, family='AF_UNIX', authkey=self.authkey)
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.socket_path, 0o660)
+        with listener:
+            logger.info(f"Tile server listening on {self.socket_path}, serving {', '.join(self.roots)}")
+            try:
+                while True:
+                    try:
+                        connection = listener.accept()
+                    except (AuthenticationError, OSError, EOFError) as e:
+                        logger.warning(f"Rejected tile server client: {e}")
+                        continue
+                    threading.Thread(target=self.serve_client, args=(connection,),
+                                     daemon=True).start()
+            finally:
+                for manager in self.managers.values():
+                    manager.close_file()
+
+
+class TileClientCacheManager(ImageCacheManager):
+    """ImageCacheManager that fetches rendered tiles from a TileServer.
+
+    Falls back to reading the file in-process if the server cannot be reached.
+    """
+
+    def __init__(self, socket_path, file_path, image_key, cache_size=50, memmap=True,
+                 key_path=None):
+        super().__init__(os.path.abspath(file_path), image_key, cache_size, memmap)
+        self.socket_path = socket_path
+        self.connection = Client(socket_path, family='AF_UNIX',
+                                 authkey=tile_server_key(socket_path, key_path))
+
+    def request(self, command, *args):
+        with self.lock:
+            self.connection.send((command, self.file_path, self.image_key) + args)
+            status, result = self.connection.recv()
+        if status != 'ok':
+            raise RuntimeError(f"Tile server: {result}")
+        return result
+
+    def fall_back(self, error):
+        logger.warning(f"Tile server at {self.socket_path} failed ({error}), reading images locally")
+        self.connection.close()
+        self.connection = None
+
+    def open_file(self):
+        with self.lock:
+            if self.connection is None:
+                return super().open_file()
+            if self.image_shape is None:
+                try:
+                    self.image_shape = tuple(self.request('open'))
+                    self.n_events = self.image_shape[0]
+                    logger.info(f"Opened {self.n_events} images via tile server")
+                except (OSError, EOFError, RuntimeError) as e:
+                    self.fall_back(e)
+                    super().open_file()
+
+    def close_file(self):
+        with self.lock:
+            if self.connection is None:
+                return super().close_file()
+            try:
+                self.request('close')
+            except (OSError, EOFError, RuntimeError) as e:
+                self.fall_back(e)
+
+    def close(self):
+        super().close()
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def enable_pyramid(self, path, factors=(2, 4)):
+        if self.connection is None:
+            return super().enable_pyramid(path, factors)
+        logger.info("Tile server reads full-resolution images; thumbnail pyramid not used")
+
+    def get_image(self, image_id, channel_mode='composite'):
+        with self.lock:
+            if self.connection is None:
+                return super().get_image(image_id, channel_mode)
+            self.preload_ids([image_id], [channel_mode])
+            if self.connection is None:
+                return super().get_image(image_id, channel_mode)
+            cache_key = f"{image_id}_{channel_mode}"
+            if cache_key not in self.cache:
+                return None
+            self.cache.move_to_end(cache_key)
+            return self.cache[cache_key]
+
+    def preload_ids(self, ids, channels=None):
+        """Fetch missing tiles from the server, one request per channel mode."""
+        with self.lock:
+            if self.connection is None:
+                return super().preload_ids(ids, channels)
+            self.open_file()
+            for channel_mode in list(channels or self.selected_channels):
+                missing = [i for i in ids if i < self.n_events
+                           and f"{i}_{channel_mode}" not in self.cache]
+                if not missing:
+                    continue
+                try:
+                    tiles = self.request('tiles', missing, channel_mode)
+                except (OSError, EOFError, RuntimeError) as e:
+                    self.fall_back(e)
+                    return super().preload_ids(ids, channels)
+                for image_id, rgb in zip(missing, tiles):
+                    self._store(f"{image_id}_{channel_mode}", rgb)
+
 
 class ColorManager:
-    """Manages color assignment for labels (default scheme only)."""
+    """Deterministic label palette with precomputed Qt colours and pens."""
     
-    def __init__(self):
-        self.color_map = {}
-        self.used_colors = set()
+    def __init__(self, n_labels=0):
         self.color_schemes = {
             'default': ['red', 'blue', 'green', 'yellow', 'magenta', 'cyan', 'orange', 'purple']
         }
         self.current_scheme = 'default'
+        # Indexed by label id; painting looks up pens[label] directly
+        self.color_names = []
+        self.colors = []
+        self.pens = []
+        self.build(n_labels)
+
+    @staticmethod
+    def generate_color(label_id, n_named):
+        """Colour for labels past the named ones, spaced by the golden angle in hue."""
+        k = label_id - n_named - 1
+        hue = (0.1 + k * 0.381966) % 1.0
+        # Cycle lightness and saturation so neighbouring hues stay distinguishable
+        lightness = (0.45, 0.65, 0.30)[k % 3]
+        saturation = (0.85, 0.60)[(k // 3) % 2]
+        r, g, b = colorsys.hls_to_rgb(hue, lightness, saturation)
+        return f"#{int(r * 255):02x}{int(g * 255):02x}{int(b * 255):02x}"
+
+    def build(self, n_labels):
+        """Precompute colours and pens for label ids 0..n_labels-1."""
+        named = self.color_schemes[self.current_scheme]
+        for label_id in range(len(self.color_names), n_labels):
+            if label_id == 0:
+                # Label 0 (class 0) always gets black
+                color = 'black'
+            elif label_id <= len(named):
+                color = named[label_id - 1]
+            else:
+                color = self.generate_color(label_id, len(named))
+            qt_color = QColor(self.get_qt_color(color))
+            pen = QPen(qt_color)
+            pen.setWidth(4)
+            self.color_names.append(color)
+            self.colors.append(qt_color)
+            self.pens.append(pen)
     
-    def get_color_for_label(self, label_id, label_name):
-        """Get or assign a color for a label."""
-        if label_id in self.color_map:
-            return self.color_map[label_id]
-        
-        # Special case: label 0 (class 0) always gets black
-        if label_id == 0:
-            color = 'black'
-            self.color_map[label_id] = color
-            self.used_colors.add(color)
-            return color
-        
-        # Get available colors from default scheme
-        available_colors = [c for c in self.color_schemes['default'] 
-                           if c not in self.used_colors]
-        
-        if not available_colors:
-            # Generate a random color if we run out
-            color = f"rgb({random.randint(0, 255)}, {random.randint(0, 255)}, {random.randint(0, 255)})"
-        else:
-            color = available_colors[0]
-        
-        self.color_map[label_id] = color
-        self.used_colors.add(color)
-        return color
+    def get_color_for_label(self, label_id, label_name=None):
+        """CSS colour string for a label."""
+        if label_id >= len(self.color_names):
+            self.build(label_id + 1)
+        return self.color_names[label_id]
+
+    def color(self, label_id):
+        """QColor for a label."""
+        try:
+            return self.colors[label_id]
+        except IndexError:
+            self.build(label_id + 1)
+            return self.colors[label_id]
+
+    def pen(self, label_id):
+        """Tile border pen for a label."""
+        try:
+            return self.pens[label_id]
+        except IndexError:
+            self.build(label_id + 1)
+            return self.pens[label_id]
     
     # No-op: color scheme changes are disabled; default is always used
     
     def reset_colors(self):
-        """Reset all assigned colors."""
-        self.color_map.clear()
-        self.used_colors.clear()
+        """Rebuild the palette for the current label table."""
+        n_labels = len(self.color_names)
+        self.color_names, self.colors, self.pens = [], [], []
+        self.build(n_labels)
         logger.info("Color assignments reset")
     
     def get_qt_color(self, color_string):
@@ -253,7 +1841,8 @@ class ColorManager:
                 'black': Qt.black,
                 'white': Qt.white
             }
-            return color_map.get(color_string, Qt.black)
+            # Anything else (orange, purple, #rrggbb) is parsed by QColor
+            return color_map.get(color_string, QColor(color_string))
 
 
 # Classes
@@ -344,6 +1933,125 @@ class Legend(QWidget):
             print(f"{radioButton.name} toggled!")
 
 
+class StatisticsPanel(QGroupBox):
+    """Live label counts per class, unlabelled remainder and page progress."""
+
+    def __init__(self, color_manager):
+        super().__init__("Progress")
+        self.color_manager = color_manager
+        self.setFixedHeight(80)
+        self.count_labels = {}
+        layout = QHBoxLayout()
+        for i, label in enumerate(config['labels']):
+            if label['active']:
+                count_label = QLabel()
+                color_string = self.color_manager.get_color_for_label(i, label['name'])
+                qt_color = QColor(self.color_manager.get_qt_color(color_string))
+                count_label.setStyleSheet(f"border-left: 6px solid {qt_color.name()}; padding-left: 3px;")
+                self.count_labels[i] = count_label
+                layout.addWidget(count_label)
+        self.unlabelled_label = QLabel()
+        self.pages_label = QLabel()
+        layout.addWidget(self.unlabelled_label)
+        layout.addWidget(self.pages_label)
+        self.setLayout(layout)
+
+    def refresh(self, stats, pages_completed, n_pages):
+        if stats is None:
+            return
+        for i, count_label in self.count_labels.items():
+            count = stats.counts[i] if i < len(stats.counts) else 0
+            count_label.setText(f"{config['labels'][i]['name']}: {count}")
+        self.unlabelled_label.setText(f"Unlabelled: {stats.unlabelled()} / {stats.n_events}")
+        self.pages_label.setText(f"Pages: {pages_completed} / {n_pages}")
+
+
+class PageMinimap(QWidget):
+    """Overview strip with one column per page, stacked by label composition."""
+
+    def __init__(self, main_window, color_manager):
+        super().__init__()
+        self.main_window = main_window
+        self.color_manager = color_manager
+        self.setFixedHeight(24)
+        self.setCursor(Qt.PointingHandCursor)
+        self.setToolTip("Label composition per page; click to jump")
+        # (n_pages, n_classes) label counts per page of the navigation sequence
+        self.composition = None
+        # Position of each event in the navigation sequence, -1 if absent
+        self.positions = None
+        self.page_size = 1
+        self.palette = None
+        self.buffer = None
+        self.image = None
+
+    def rebuild(self, labels, nav_order, page_size, n_pages):
+        """Recount every page from the label array."""
+        labels = np.asarray(labels, dtype=np.int64)
+        n_classes = max(len(config['labels']), int(labels.max()) + 1 if len(labels) else 1)
+        if nav_order is None:
+            self.positions = np.arange(len(labels))
+        else:
+            self.positions = np.full(len(labels), -1, dtype=np.int64)
+            self.positions[nav_order] = np.arange(len(nav_order))
+            labels = labels[nav_order]
+        self.page_size = page_size
+        pages = np.arange(len(labels)) // page_size
+        self.composition = np.bincount(pages * n_classes + labels,
+                                       minlength=n_pages * n_classes).reshape(n_pages, n_classes)
+        # Unlabelled cells grey rather than black, and a darker grey for empty pages
+        colors = [(c.red(), c.green(), c.blue())
+                  for c in (self.color_manager.color(i) for i in range(n_classes))]
+        colors[0] = (90, 90, 90)
+        self.palette = np.array(colors + [(30, 30, 30)], dtype=np.uint8)
+        self.buffer = np.zeros((self.height(), n_pages, 3), dtype=np.uint8)
+        self.render_pages(np.arange(n_pages))
+        self.image = QImage(self.buffer.data, n_pages, self.height(), 3 * n_pages,
+                            QImage.Format_RGB888)
+        self.update()
+
+    def update_labels(self, ids, old_labels, new_label):
+        """Move a batch of events from old_labels to new_label."""
+        if self.composition is None or new_label >= self.composition.shape[1]:
+            self.main_window.refresh_minimap()
+            return
+        positions = self.positions[ids]
+        present = positions >= 0
+        pages = positions[present] // self.page_size
+        np.subtract.at(self.composition, (pages, old_labels[present]), 1)
+        np.add.at(self.composition, (pages, new_label), 1)
+        self.render_pages(np.unique(pages))
+        self.update()
+
+    def render_pages(self, pages):
+        """Redraw the columns of the given pages into the image buffer."""
+        counts = self.composition[pages]
+        fractions = np.cumsum(counts, axis=1) / np.maximum(counts.sum(axis=1), 1)[:, None]
+        rows = (np.arange(self.buffer.shape[0]) + 0.5) / self.buffer.shape[0]
+        # Class drawn at each row: the first whose cumulative share reaches it
+        classes = (fractions[None, :, :] < rows[:, None, None]).sum(axis=2)
+        self.buffer[:, pages] = self.palette[classes]
+
+    def page_at(self, x):
+        return 1 + min(len(self.composition) - 1, x * len(self.composition) // max(self.width(), 1))
+
+    def paintEvent(self, event):
+        if self.image is None:
+            return
+        p = QPainter(self)
+        p.drawImage(self.rect(), self.image)
+        # Marker for the current page
+        n_pages = len(self.composition)
+        left = (self.main_window.current_page - 1) * self.width() // n_pages
+        right = self.main_window.current_page * self.width() // n_pages
+        p.setPen(QPen(Qt.white, 2))
+        p.drawRect(left, 1, max(right - left, 2), self.height() - 2)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton and self.composition is not None:
+            self.main_window.go_to_page(self.page_at(event.x()))
+
+
 class Label(QWidget):
 
     def __init__(self, id, color_manager):
@@ -412,7 +2120,7 @@ class TextBox(QWidget):
 
     def update_text(self):
         if self.textbox.text() != '':
-            if isinstance(config[self.key], str):
+            if isinstance(config.get(self.key, ''), str):
                 config[self.key] = self.textbox.text()
             elif isinstance(config[self.key], int):
                 config[self.key] = int(self.textbox.text())
@@ -451,6 +2159,8 @@ class SettingWindow(QWidget):
         
         self.image_key = TextBox(
             'image_key', 'image key: ', config['image_key'])
+        self.image_path = TextBox(
+            'image_path', 'image path (optional): ', config.get('image_path', ''))
         self.data_key = TextBox(
             'data_key', 'data key: ', config['data_key'])
         self.tile_size = TextBox(
@@ -461,6 +2171,7 @@ class SettingWindow(QWidget):
             'y_size', 'vertical tile count', config['y_size'])
 
         layout.addWidget(self.image_key)
+        layout.addWidget(self.image_path)
         layout.addWidget(self.data_key)
         layout.addWidget(self.tile_size)
         layout.addWidget(self.x_size)
@@ -484,6 +2195,14 @@ class Pos(QWidget):
         self.id = id
         self.image = qImage
         self.label = label
+        # Label proposed by the active learner, drawn as a corner marker
+        self.suggestion = None
+        # Called with ([id], label) so the owner can record the change
+        self.on_label_changed = None
+        # Highlighted by the keyboard tile cursor
+        self.cursor = False
+        # Showing a stand-in until the image arrives, see MainWindow.on_tiles_loaded
+        self.placeholder = False
         
     def reset(self, id, qImage, label):
         self.id = id
@@ -498,19 +2217,29 @@ class Pos(QWidget):
         r = event.rect()
         p.drawImage(r, self.image)
         # p.drawPixmap(r, QPixmap(self.image))
-        color = self.get_color()
-        pen = QPen(color)
-        pen.setWidth(4)
-        p.setPen(pen)
+        p.setPen(self.color_manager.pen(self.label))
         p.drawRect(r)
+        if self.suggestion is not None:
+            marker = self.width() // 5
+            p.fillRect(self.width() - marker - 4, 4, marker, marker,
+                       self.get_color(self.suggestion))
+        if self.cursor:
+            pen = QPen(Qt.white, 2, Qt.DashLine)
+            p.setPen(pen)
+            p.drawRect(self.rect().adjusted(6, 6, -7, -7))
         
     def flag(self):
-        self.label = config['active_label']
+        self.set_label(config['active_label'])
         logger.info(f"Event {self.id} is selected!")
+
+    def set_label(self, label):
+        self.label = label
         self.update()
         
         # Update all channel views of the same image
         self.update_all_channels_for_image()
+        if self.on_label_changed is not None:
+            self.on_label_changed([self.id], label)
         
     def update_all_channels_for_image(self):
         """Update all channel views of the same image with the current label."""
@@ -528,40 +2257,267 @@ class Pos(QWidget):
                             widget.label = self.label
                             widget.update()
 
-    def junk(self):
-        self.label = 0
-        logger.info(f"Event {self.id} is discarded!")
-        self.update()
-        
-        # Update all channel views of the same image
-        self.update_all_channels_for_image()
+    def junk(self):
+        self.set_label(0)
+        logger.info(f"Event {self.id} is discarded!")
+
+    def get_color(self, label=None):
+        if label is None:
+            label = self.label
+        return self.color_manager.color(label)
+
+    def event(self, event):
+        # Tooltip text is built only when Qt asks for it, never while painting
+        if event.type() == QEvent.ToolTip:
+            QToolTip.showText(event.globalPos(), self.window().event_tooltip(self.id), self)
+            return True
+        return super(Pos, self).event(event)
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.RightButton and event.modifiers() & Qt.ControlModifier:
+            self.window().show_tile_menu(self.id, event.globalPos())
+        elif event.button() == Qt.RightButton:
+            self.window().record('junk', self.id)
+            self.junk()
+        else:
+            # Left clicks and drags are handled by the TileGrid
+            event.ignore()
+
+
+class TileGrid(QWidget):
+    """Container of the paged grid; handles left clicks, shift-click ranges and drag selection.
+
+    Pos widgets ignore left presses, so they arrive here and the grid keeps the mouse
+    until release. Right clicks still go to the Pos under the cursor.
+    """
+
+    def __init__(self, main_window, *args, **kwargs):
+        super(TileGrid, self).__init__(*args, **kwargs)
+        self.main_window = main_window
+        self.rubber_band = QRubberBand(QRubberBand.Rectangle, self)
+        self.origin = None
+        # (page, index on page) of the last plain click, start of shift-click ranges
+        self.anchor = None
+
+    def tile_at(self, point):
+        widget = self.childAt(point)
+        while widget is not None and not isinstance(widget, Pos):
+            widget = widget.parentWidget()
+        return widget
+
+    def page_index(self, tile):
+        """Row-major index of a tile on the current page."""
+        container = tile.parentWidget()
+        row, column, _, _ = self.main_window.grid.getItemPosition(
+            self.main_window.grid.indexOf(container))
+        return row * self.main_window.x_size + column
+
+    def mousePressEvent(self, event):
+        if event.button() != Qt.LeftButton:
+            return super(TileGrid, self).mousePressEvent(event)
+        self.origin = event.pos()
+        self.rubber_band.setGeometry(QRect(self.origin, QSize()))
+
+    def mouseMoveEvent(self, event):
+        if self.origin is None:
+            return
+        if (event.pos() - self.origin).manhattanLength() >= QApplication.startDragDistance():
+            self.rubber_band.setGeometry(QRect(self.origin, event.pos()).normalized())
+            self.rubber_band.show()
+
+    def mouseReleaseEvent(self, event):
+        if event.button() != Qt.LeftButton or self.origin is None:
+            return super(TileGrid, self).mouseReleaseEvent(event)
+        window = self.main_window
+        if self.rubber_band.isVisible():
+            self.rubber_band.hide()
+            band = self.rubber_band.geometry()
+            ids = [w.id for w in window.page_tiles()
+                   if band.intersects(QRect(w.mapTo(self, QPoint(0, 0)), w.size()))]
+            window.label_selection(ids)
+        else:
+            tile = self.tile_at(event.pos())
+            if tile is not None:
+                index = self.page_index(tile)
+                if (event.modifiers() & Qt.ShiftModifier and self.anchor is not None
+                        and self.anchor[0] == window.current_page):
+                    first, last = sorted((self.anchor[1], index))
+                    window.label_selection([window.calc_index(i % window.x_size, i // window.x_size)
+                                            for i in range(first, last + 1)])
+                else:
+                    window.record('flag', tile.id, config['active_label'])
+                    tile.flag()
+                    self.anchor = (window.current_page, index)
+        self.origin = None
+
+
+class GalleryView(QAbstractScrollArea):
+    """Continuous-scroll view that only paints the tiles inside the viewport."""
+
+    def __init__(self, main_window, *args, **kwargs):
+        super(GalleryView, self).__init__(*args, **kwargs)
+        self.main_window = main_window
+        self.last_row = 0
+        self.setFocusPolicy(Qt.NoFocus)
+        self.verticalScrollBar().valueChanged.connect(self.on_scroll)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+
+    def tile_width(self):
+        return config['tile_size'] * len(self.main_window.selected_channels)
+
+    def columns(self):
+        return max(1, self.viewport().width() // self.tile_width())
+
+    def visible_rows(self):
+        # Count a partially visible bottom row as visible
+        return 1 + self.viewport().height() // config['tile_size']
+
+    def n_rows(self):
+        n_positions = self.main_window.n_positions()
+        return (n_positions + self.columns() - 1) // self.columns()
+
+    def update_scrollbar(self):
+        """Size the scroll range in rows so it never depends on the event count."""
+        scrollbar = self.verticalScrollBar()
+        page_rows = max(1, self.viewport().height() // config['tile_size'])
+        scrollbar.setRange(0, max(0, self.n_rows() - page_rows))
+        scrollbar.setPageStep(page_rows)
+        scrollbar.setSingleStep(1)
+        # Keep enough room in the cache for everything on screen plus read-ahead
+        if self.main_window.image_cache:
+            n_tiles = (self.visible_rows() + 2 * self.readahead_rows()) * self.columns()
+            self.main_window.image_cache.min_capacity = \
+                n_tiles * len(self.main_window.selected_channels)
 
-    def get_color(self):
-        # Resolve label name
-        try:
-            label_name = config['labels'][self.label]['name']
-        except Exception:
-            label_name = f"label_{self.label}"
+    def readahead_rows(self):
+        return config.get('gallery_readahead_rows', 2 * self.visible_rows())
+
+    def first_position(self):
+        return self.verticalScrollBar().value() * self.columns()
+
+    def scroll_to_position(self, position):
+        self.update_scrollbar()
+        self.verticalScrollBar().setValue(position // self.columns())
+        self.viewport().update()
+
+    def scroll_pages(self, n_pages):
+        scrollbar = self.verticalScrollBar()
+        scrollbar.setValue(scrollbar.value() + n_pages * scrollbar.pageStep())
+
+    def visible_ids(self):
+        """Event ids of the tiles currently on screen."""
+        start = self.first_position()
+        end = min(start + self.visible_rows() * self.columns(),
+                  self.main_window.n_positions())
+        return [self.main_window.event_at(pos) for pos in range(start, end)]
+
+    def on_scroll(self, row):
+        """Read ahead of the viewport in the direction the user is scrolling."""
+        direction = 1 if row >= self.last_row else -1
+        self.last_row = row
+        if self.main_window.image_cache:
+            cols = self.columns()
+            n_ahead = self.readahead_rows() * cols
+            if direction > 0:
+                start = (row + self.visible_rows()) * cols
+            else:
+                start = max(0, row * cols - n_ahead)
+            end = min(start + n_ahead, self.main_window.n_positions())
+            ids = [self.main_window.event_at(pos) for pos in range(start, end)]
+            if direction < 0:
+                # Nearest rows first when scrolling up
+                ids.reverse()
+            self.main_window.image_cache.prefetch(ids)
+        self.viewport().update()
+
+    def resizeEvent(self, event):
+        super(GalleryView, self).resizeEvent(event)
+        self.update_scrollbar()
+
+    def paintEvent(self, event):
+        p = QPainter(self.viewport())
+        self.paint_tiles(p)
+        p.end()
 
-        # Prefer ColorManager for dynamic color resolution
-        if hasattr(self, 'color_manager') and self.color_manager:
-            color_string = self.color_manager.get_color_for_label(self.label, label_name)
-            return self.color_manager.get_qt_color(color_string)
+    def paint_tiles(self, p):
+        """Draw cached tiles and placeholders; never read images on the GUI thread."""
+        tile_size = config['tile_size']
+        cols = self.columns()
+        first = self.first_position()
+        n_positions = self.main_window.n_positions()
+        image_cache = self.main_window.image_cache
+        missing = []
+        for row in range(self.visible_rows()):
+            for col in range(cols):
+                position = first + row * cols + col
+                if position >= n_positions:
+                    break
+                id = self.main_window.event_at(position)
+                label = self.main_window.get_label(id)
+                for i, channel in enumerate(self.main_window.selected_channels):
+                    r = QRect((col * len(self.main_window.selected_channels) + i) * tile_size,
+                              row * tile_size, tile_size, tile_size)
+                    image_data = image_cache.peek(id, channel) if image_cache else None
+                    if image_data is None:
+                        qImage, arr = self.main_window.placeholder_image()
+                        missing.append(id)
+                    else:
+                        arr = np.ascontiguousarray(image_data)
+                        h, w = arr.shape[:2]
+                        qImage = QImage(arr.data, w, h, w * 3, QImage.Format_RGB888)
+                    p.drawImage(r, qImage)
+                    p.setPen(self.main_window.color_manager.pen(label))
+                    p.drawRect(r)
+                    suggestion = self.main_window.get_suggestion(id)
+                    if suggestion is not None:
+                        marker = tile_size // 5
+                        p.fillRect(r.right() - marker - 3, r.top() + 4, marker, marker,
+                                   self.main_window.label_color(suggestion))
+        # Visible tiles go ahead of any read-ahead; on_tiles_loaded repaints as they arrive
+        if missing and image_cache and set(missing) != set(image_cache.required_ids):
+            image_cache.require(missing)
+
+    def id_at(self, point):
+        """Map a viewport coordinate to an event id, or None outside the tiles."""
+        col = point.x() // self.tile_width()
+        if col >= self.columns():
+            return None
+        position = self.first_position() + (point.y() // config['tile_size']) * self.columns() + col
+        if position >= self.main_window.n_positions():
+            return None
+        return self.main_window.event_at(position)
 
-        # Fallback to a deterministic basic palette
-        fallback_colors = [Qt.red, Qt.blue, Qt.green, Qt.yellow, Qt.magenta, Qt.cyan, Qt.black]
-        return fallback_colors[self.label % len(fallback_colors)]
+    def viewportEvent(self, event):
+        if event.type() == QEvent.ToolTip:
+            id = self.id_at(event.pos())
+            if id is None:
+                QToolTip.hideText()
+            else:
+                QToolTip.showText(event.globalPos(), self.main_window.event_tooltip(id),
+                                  self.viewport())
+            return True
+        return super(GalleryView, self).viewportEvent(event)
 
     def mouseReleaseEvent(self, event):
-        if event.button() == Qt.RightButton:
-            self.junk()
+        id = self.id_at(event.pos())
+        if id is None:
+            return
+        if event.button() == Qt.RightButton and event.modifiers() & Qt.ControlModifier:
+            self.main_window.show_tile_menu(id, event.globalPos())
+        elif event.button() == Qt.RightButton:
+            self.main_window.record('junk', id)
+            self.main_window.set_labels([id], 0)
+            logger.info(f"Event {id} is discarded!")
         elif event.button() == Qt.LeftButton:
-            self.flag()
+            self.main_window.record('flag', id, config['active_label'])
+            self.main_window.set_labels([id], config['active_label'])
+            logger.info(f"Event {id} is selected!")
 
 
 class MainWindow(QMainWindow):
     
-    def __init__(self, *args, **kwargs):
+    def __init__(self, f_path=None, *args, **kwargs):
+        """Ask for settings and a file, or open f_path directly (headless replay)."""
         super(MainWindow, self).__init__(*args, **kwargs)
         #self.setStyleSheet("background-color: black;")
         self.current_page = 0
@@ -570,15 +2526,44 @@ class MainWindow(QMainWindow):
         
         # Initialize managers
         self.image_cache = None
-        self.color_manager = ColorManager()
+        self.color_manager = ColorManager(len(config['labels']))
         
         # Channel selection
         self.selected_channels = ['composite']
         self.channel_widgets = []
         
+        # Optional navigation sequence (event ids) replacing storage order
+        self.nav_order = None
+        self.nav_name = 'storage order'
+        self.embedding_index = None
+        # Feature columns shown in hover tooltips, extracted from df on first use
+        self.tooltip_arrays = {}
+        self.learner = None
+        self.reviewed = np.zeros(0, dtype=bool)
+        self.label_stats = None
+        self.completed_pages = set()
+        
+        # Keyboard tile cursor as (x, y) on the current page
+        self.cursor_mode = False
+        self.cursor_pos = (0, 0)
+        # Lookahead grows with the speed of page turns, see schedule_prefetch
+        self.nav_tracker = NavigationTracker(max_depth=config.get('prefetch_pages', 1))
+        
+        # Optional TraceRecorder of user actions, see record
+        self.recorder = None
+        # AnnotationJournal of label changes when annotation_journal is enabled
+        self.journal = None
+        # FeatureCompaction applied to df on load, see full_features
+        self.compaction = None
+        # ReviewSidecar while a QA review is running
+        self.review = None
+        
         # Color scheme selection disabled; always default
         
-        self.open_settings()
+        if f_path is None:
+            self.open_settings()
+        else:
+            self.deploy_config()
 
         self.dialog = QFileDialog()
         self.dialog.setFileMode(QFileDialog.AnyFile)
@@ -630,15 +2615,47 @@ class MainWindow(QMainWindow):
         self.loadbutton.setIcon(QIcon("./icons/Open.png"))
         self.loadbutton.setFixedSize(QSize(64, 64))
         self.loadbutton.pressed.connect(self.load_data)
+        
+        self.gallerybutton = QToolButton()
+        self.gallerybutton.setText("Gallery")
+        self.gallerybutton.setToolButtonStyle(Qt.ToolButtonTextUnderIcon)
+        self.gallerybutton.setIconSize(QSize(32, 32))
+        self.gallerybutton.setIcon(QIcon("./icons/Frames.png"))
+        self.gallerybutton.setFixedSize(QSize(64, 64))
+        self.gallerybutton.setCheckable(True)
+        self.gallerybutton.toggled.connect(self.toggle_gallery)
+        
+        self.exportbutton = QToolButton()
+        self.exportbutton.setText("Export")
+        self.exportbutton.setToolButtonStyle(Qt.ToolButtonTextUnderIcon)
+        self.exportbutton.setIconSize(QSize(32, 32))
+        self.exportbutton.setIcon(QIcon("./icons/Export.png"))
+        self.exportbutton.setFixedSize(QSize(64, 64))
+        self.exportbutton.pressed.connect(self.export_labelled)
+        
+        self.learnbutton = QToolButton()
+        self.learnbutton.setText("Learn")
+        self.learnbutton.setToolButtonStyle(Qt.ToolButtonTextUnderIcon)
+        self.learnbutton.setIconSize(QSize(32, 32))
+        self.learnbutton.setIcon(QIcon("./icons/Magic hat.png"))
+        self.learnbutton.setFixedSize(QSize(64, 64))
+        self.learnbutton.setCheckable(True)
+        self.learnbutton.toggled.connect(self.toggle_active_learning)
        
         self.grid = QGridLayout()
+        # Pos widgets of the current page by event id, one per displayed channel
+        self.tiles_by_id = {}
         self.grid.setSpacing(0)
         self.grid.setContentsMargins(0, 0, 0, 0)
         # Wrap grid in a QWidget so we can control and measure its size
-        self.grid_widget = QWidget()
+        self.grid_widget = TileGrid(self)
         self.grid_widget.setLayout(self.grid)
         self.grid_widget.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
         
+        # Continuous-scroll alternative to the paged grid
+        self.gallery = GalleryView(self)
+        self.gallery.hide()
+        
         self.page_number = QLabel()
         self.page_number.setFixedSize(QSize(64, 64))
         self.page_number.setAlignment(Qt.AlignCenter)
@@ -651,12 +2668,17 @@ class MainWindow(QMainWindow):
         
         # Grid size controls
         self.create_grid_controls()
+        
+        self.stats_panel = StatisticsPanel(self.color_manager)
+        self.minimap = PageMinimap(self, self.color_manager)
 
         # Control panels (wrap in a QWidget so we can get sizeHint reliably)
         control_panel_layout = QVBoxLayout()
         control_panel_layout.setContentsMargins(5, 5, 5, 5)
         control_panel_layout.addWidget(self.channel_group)
         control_panel_layout.addWidget(self.grid_group)
+        control_panel_layout.addWidget(self.stats_panel)
+        control_panel_layout.addWidget(self.minimap)
         
         key_box = QHBoxLayout()
         key_box.setContentsMargins(0, 0, 0, 0)
@@ -669,6 +2691,9 @@ class MainWindow(QMainWindow):
         key_box.addWidget(self.nextbutton)
         key_box.addWidget(self.savebutton)
         key_box.addWidget(self.loadbutton)
+        key_box.addWidget(self.exportbutton)
+        key_box.addWidget(self.gallerybutton)
+        key_box.addWidget(self.learnbutton)
         
         control_panel_layout.addLayout(key_box)
         self.control_panel_widget = QWidget()
@@ -678,6 +2703,7 @@ class MainWindow(QMainWindow):
         main_box.setContentsMargins(0, 0, 0, 0)
         main_box.setSpacing(0)
         main_box.addWidget(self.grid_widget)
+        main_box.addWidget(self.gallery)
         main_box.addWidget(self.control_panel_widget)
 
         main_widget = QWidget()
@@ -686,8 +2712,16 @@ class MainWindow(QMainWindow):
         
         # Add keyboard shortcuts
         self.setup_shortcuts()
+
+        self.profiler = SessionProfiler()
+
+        # Resize the image cache as process and system memory pressure changes
+        self.memory_timer = QTimer(self)
+        self.memory_timer.timeout.connect(self.check_memory)
+        if config.get('adaptive_cache', False) and read_memory_status() is not None:
+            self.memory_timer.start(config.get('memory_check_interval', 5000))
         
-        self.load_data(init_map=True)
+        self.load_data(init_map=True, f_path=f_path)
         self.show()
 
     def setup_shortcuts(self):
@@ -695,30 +2729,138 @@ class MainWindow(QMainWindow):
         # Clear image cache shortcut (Ctrl+Shift+C)
         clear_cache_shortcut = QShortcut(QKeySequence("Ctrl+Shift+C"), self)
         clear_cache_shortcut.activated.connect(self.clear_image_cache)
+
+        # Start/stop the session profiler (Ctrl+Shift+P)
+        profiler_shortcut = QShortcut(QKeySequence("Ctrl+Shift+P"), self)
+        profiler_shortcut.activated.connect(self.toggle_profiler)
         
-        # Page navigation shortcuts
+        # Page navigation shortcuts (move the tile cursor in cursor mode)
         next_page_shortcut = QShortcut(QKeySequence("Right"), self)
-        next_page_shortcut.activated.connect(self.nextPage)
+        next_page_shortcut.activated.connect(lambda: self.on_arrow(1, 0))
         
         prev_page_shortcut = QShortcut(QKeySequence("Left"), self)
-        prev_page_shortcut.activated.connect(self.prevPage)
+        prev_page_shortcut.activated.connect(lambda: self.on_arrow(-1, 0))
         
         # Label selection shortcuts (number keys 0-9)
         for i in range(10):
             shortcut = QShortcut(QKeySequence(str(i)), self)
-            shortcut.activated.connect(lambda checked=False, label_id=i: self.select_label(label_id))
+            shortcut.activated.connect(lambda checked=False, label_id=i: self.on_number_key(label_id))
         
         # Additional navigation shortcuts
         up_shortcut = QShortcut(QKeySequence("Up"), self)
-        up_shortcut.activated.connect(self.prevPage)
+        up_shortcut.activated.connect(lambda: self.on_arrow(0, -1))
         
         down_shortcut = QShortcut(QKeySequence("Down"), self)
-        down_shortcut.activated.connect(self.nextPage)
+        down_shortcut.activated.connect(lambda: self.on_arrow(0, 1))
+        
+        # Vim-style cursor movement, only used in cursor mode
+        for key, dx, dy in (("H", -1, 0), ("J", 0, 1), ("K", 0, -1), ("L", 1, 0)):
+            shortcut = QShortcut(QKeySequence(key), self)
+            shortcut.activated.connect(lambda dx=dx, dy=dy: self.move_cursor(dx, dy)
+                                       if self.cursor_mode else None)
+        
+        # Keyboard tile cursor for mouse-free labelling
+        cursor_shortcut = QShortcut(QKeySequence("Ctrl+K"), self)
+        cursor_shortcut.activated.connect(self.toggle_cursor_mode)
+        
+        # Return to storage order after sorting by similarity
+        reset_order_shortcut = QShortcut(QKeySequence("Escape"), self)
+        reset_order_shortcut.activated.connect(self.clear_navigation_order)
+        
+        # Toggle between paged grid and continuous-scroll gallery
+        gallery_shortcut = QShortcut(QKeySequence("Ctrl+G"), self)
+        gallery_shortcut.activated.connect(self.gallerybutton.toggle)
+        
+        # Full TSV export of the features and labels
+        tsv_shortcut = QShortcut(QKeySequence("Ctrl+T"), self)
+        tsv_shortcut.activated.connect(self.export_tsv)
+        
+        # Stratified QA review of a sample of each class
+        review_shortcut = QShortcut(QKeySequence("Ctrl+R"), self)
+        review_shortcut.activated.connect(self.toggle_review)
+        
+        # Active-learning queue
+        learn_shortcut = QShortcut(QKeySequence("Ctrl+L"), self)
+        learn_shortcut.activated.connect(self.learnbutton.toggle)
         
         # Help shortcut (F1)
         help_shortcut = QShortcut(QKeySequence("F1"), self)
         help_shortcut.activated.connect(self.show_help)
 
+    def on_arrow(self, dx, dy):
+        """Arrow keys move the tile cursor in cursor mode and turn pages otherwise."""
+        if self.cursor_mode and not self.gallerybutton.isChecked():
+            self.move_cursor(dx, dy)
+        elif dx + dy > 0:
+            self.nextPage()
+        else:
+            self.prevPage()
+
+    def on_number_key(self, label_id):
+        if self.cursor_mode and not self.gallerybutton.isChecked():
+            self.label_at_cursor(label_id)
+        else:
+            self.select_label(label_id)
+
+    def toggle_cursor_mode(self):
+        self.record('toggle_cursor_mode')
+        self.cursor_mode = not self.cursor_mode
+        self.cursor_pos = (0, 0)
+        self.set_cursor_highlight(self.cursor_pos, self.cursor_mode)
+        logger.info(f"Cursor mode {'on' if self.cursor_mode else 'off'}")
+
+    def tiles_at(self, x, y):
+        """Pos widgets (one per channel) at a grid position."""
+        item = self.grid.itemAtPosition(y, x)
+        container = item.widget() if item else None
+        if not container or not container.layout():
+            return []
+        channel_layout = container.layout()
+        return [channel_layout.itemAt(i).widget() for i in range(channel_layout.count())]
+
+    def set_cursor_highlight(self, pos, on):
+        for w in self.tiles_at(*pos):
+            w.cursor = on
+            w.update()
+
+    def move_cursor(self, dx, dy):
+        """Move the cursor; horizontal moves wrap across rows and pages."""
+        # Page turns made by the cursor replay as part of this action
+        with self.recording_as('move_cursor', dx, dy):
+            x, y = self.cursor_pos
+            if dx:
+                index = y * self.x_size + x + dx
+                if index >= self.x_size * self.y_size:
+                    self.nextPage()
+                    index = 0
+                elif index < 0:
+                    if self.current_page == 1:
+                        return
+                    self.prevPage()
+                    index = self.x_size * self.y_size - 1
+                new_pos = (index % self.x_size, index // self.x_size)
+            else:
+                new_pos = (x, min(max(y + dy, 0), self.y_size - 1))
+            # Only the old and the new tile repaint
+            self.set_cursor_highlight(self.cursor_pos, False)
+            self.cursor_pos = new_pos
+            self.set_cursor_highlight(self.cursor_pos, True)
+            # Start reading the next page once the cursor reaches the last row
+            if new_pos[1] == self.y_size - 1 and self.image_cache and self.current_page < self.n_pages:
+                self.image_cache.prefetch(self.page_ids(self.current_page + 1))
+
+    def label_at_cursor(self, label_id):
+        """Apply a label to the tile under the cursor and advance."""
+        if label_id >= len(config['labels']) or not config['labels'][label_id]['active']:
+            logger.warning(f"Label {label_id} is not available or not active")
+            return
+        with self.recording_as('label_at_cursor', label_id):
+            tiles = self.tiles_at(*self.cursor_pos)
+            if tiles:
+                self.set_labels([tiles[0].id], label_id)
+                logger.info(f"Event {tiles[0].id} labelled {config['labels'][label_id]['name']}")
+            self.move_cursor(1, 0)
+
     def select_label(self, label_id):
         """Select a label using keyboard shortcut."""
         # Check if the label exists and is active
@@ -789,16 +2931,29 @@ Navigation:
 Label Selection:
 • 0-9 - Select label by number (if available and active)
 
+Cursor Mode (Ctrl+K):
+• Arrow keys or h/j/k/l - Move the tile cursor
+• 0-9 - Label the tile under the cursor and advance
+
 Actions:
 • Left Click - Select/flag an image tile
+• Left Drag - Label all tiles inside the rectangle
+• Shift+Left Click - Label the range from the last clicked tile
 • Right Click - Mark an image tile as junk
 • Ctrl+Shift+C - Clear image cache
+• Ctrl+Shift+P - Start/stop profiling (reports go to output_dir)
+• Ctrl+G - Toggle continuous-scroll gallery view
+• Ctrl+Right Click - Sort by similarity / label nearest neighbours
+• Escape - Return to storage order
+• Ctrl+L - Toggle active-learning queue
+• Ctrl+R - Start/stop stratified QA review
+• Ctrl+T - Export features and labels as TSV
 
 Channel Selection:
 • Use checkboxes in the Channels panel
 
 Grid Size:
-• Use X/Y spinboxes and Apply button
+• Use X/Y/Tile spinboxes and Apply button
         """
         
         msg = QMessageBox()
@@ -848,14 +3003,27 @@ Grid Size:
         self.y_spinbox.setValue(config.get('y_size', 15))
         self.y_spinbox.valueChanged.connect(self.on_grid_size_changed)
         
+        # Tile size control
+        tile_label = QLabel("Tile:")
+        tile_label.setFixedWidth(30)
+        self.tile_spinbox = QSpinBox()
+        self.tile_spinbox.setRange(15, 501)
+        self.tile_spinbox.setSingleStep(10)
+        self.tile_spinbox.setValue(config.get('tile_size', 85))
+        self.tile_spinbox.valueChanged.connect(self.on_grid_size_changed)
+        
         # Apply button
         apply_button = QPushButton("Apply")
-        apply_button.clicked.connect(self.apply_grid_changes)
+        apply_button.clicked.connect(lambda: (self.record('apply_grid_changes', config['x_size'],
+                                                          config['y_size'], config['tile_size']),
+                                              self.apply_grid_changes()))
         
         grid_layout.addWidget(x_label)
         grid_layout.addWidget(self.x_spinbox)
         grid_layout.addWidget(y_label)
         grid_layout.addWidget(self.y_spinbox)
+        grid_layout.addWidget(tile_label)
+        grid_layout.addWidget(self.tile_spinbox)
         grid_layout.addWidget(apply_button)
         
         self.grid_group.setLayout(grid_layout)
@@ -868,9 +3036,14 @@ Grid Size:
                 selected.append(channel)
         
         if not selected:
-            # If nothing selected, default to composite
-            self.channel_checkboxes['composite'].setChecked(True)
+            # If nothing selected, default to composite, without re-entering this handler
+            checkbox = self.channel_checkboxes['composite']
+            checkbox.blockSignals(True)
+            checkbox.setChecked(True)
+            checkbox.blockSignals(False)
             selected = ['composite']
+        # Record the channels that actually took effect
+        self.record('on_channel_changed', selected)
         
         self.selected_channels = selected
         
@@ -885,16 +3058,21 @@ Grid Size:
         """Handle grid size changes (just update config, don't apply yet)."""
         config['x_size'] = self.x_spinbox.value()
         config['y_size'] = self.y_spinbox.value()
+        # Odd tile sizes, as enforced by load_config
+        config['tile_size'] = 2 * (self.tile_spinbox.value() // 2) + 1
 
     def apply_grid_changes(self):
         """Apply grid size changes and refresh display."""
         self.x_size = config['x_size']
         self.y_size = config['y_size']
+        if self.image_cache:
+            self.image_cache.set_display_size(config['tile_size'])
+        self.cursor_pos = (min(self.cursor_pos[0], self.x_size - 1),
+                           min(self.cursor_pos[1], self.y_size - 1))
         
         # Recalculate pages
         if hasattr(self, 'n_events') and self.n_events > 0:
-            self.n_pages = 1 + self.n_events // (self.x_size * self.y_size)
-            self.n_tiles = self.n_pages * (self.x_size * self.y_size)
+            self.update_page_count()
             self.current_page = min(self.current_page, self.n_pages)
             self.update_page_number()
         
@@ -907,9 +3085,14 @@ Grid Size:
         
         # Force a tight layout update
         self.force_tight_layout()
+        
+        if self.gallerybutton.isChecked():
+            self.gallery.update_scrollbar()
+            self.gallery.viewport().update()
 
     def clear_grid(self):
         """Clear all widgets from the grid."""
+        self.tiles_by_id = {}
         while self.grid.count():
             child = self.grid.takeAt(0)
             if child.widget():
@@ -1009,8 +3192,270 @@ Grid Size:
                         checkbox.setEnabled(False)
 
     def calc_index(self, x, y):
-        return((self.current_page - 1) * self.x_size * self.y_size \
-               + x + self.x_size * y)
+        return self.event_at((self.current_page - 1) * self.x_size * self.y_size
+                             + x + self.x_size * y)
+
+    def n_positions(self):
+        """Number of events in the navigation sequence."""
+        if self.nav_order is not None:
+            return len(self.nav_order)
+        return getattr(self, 'n_events', 0)
+
+    def event_at(self, position):
+        """Map a position in the navigation sequence to an event id."""
+        if self.nav_order is None:
+            return position
+        if position < len(self.nav_order):
+            return int(self.nav_order[position])
+        # Past the end of the sequence: an empty tile
+        return self.n_events
+
+    def update_page_count(self):
+        self.n_pages = 1 + self.n_positions() // (self.x_size * self.y_size)
+        self.n_tiles = self.n_pages * (self.x_size * self.y_size)
+        self.refresh_minimap()
+
+    def refresh_minimap(self):
+        """Recompute the minimap for the current labels, order and page size."""
+        if 'label' in df.columns and len(df) == self.n_events:
+            self.minimap.rebuild(df['label'].to_numpy(), self.nav_order,
+                                 self.x_size * self.y_size, self.n_pages)
+
+    def page_ids(self, page):
+        """Event ids shown on a page of the navigation sequence."""
+        start = (page - 1) * self.x_size * self.y_size
+        end = min(start + self.x_size * self.y_size, self.n_positions())
+        return [self.event_at(pos) for pos in range(start, end)]
+
+    def page_tiles(self):
+        """All Pos widgets of the current page, one per displayed channel."""
+        for i in range(self.grid.count()):
+            container = self.grid.itemAt(i).widget()
+            if container and container.layout():
+                channel_layout = container.layout()
+                for j in range(channel_layout.count()):
+                    w = channel_layout.itemAt(j).widget()
+                    if isinstance(w, Pos):
+                        yield w
+
+    def set_navigation_order(self, order, name):
+        """Page through the given event ids instead of storage order."""
+        self.save_labels()
+        self.nav_order = None if order is None else np.asarray(order, dtype=np.int64)
+        self.nav_name = name if order is not None else 'storage order'
+        self.update_page_count()
+        self.current_page = 1
+        self.completed_pages = set()
+        self.refresh_statistics()
+        self.update_page_number()
+        logger.info(f"Navigating by {self.nav_name}")
+        if self.image_cache:
+            self.image_cache.prefetch(self.page_ids(self.current_page))
+        self.reset_map()
+        if self.gallerybutton.isChecked():
+            self.gallery.scroll_to_position(0)
+
+    def clear_navigation_order(self):
+        if self.review is not None:
+            self.end_review()
+        elif self.learnbutton.isChecked():
+            self.learnbutton.setChecked(False)
+        elif self.nav_order is not None:
+            self.set_navigation_order(None, None)
+
+    def get_suggestion(self, id):
+        if self.learner is None or self.learner.suggested is None or id >= self.n_events:
+            return None
+        return int(self.learner.suggested[id])
+
+    def toggle_active_learning(self, enabled):
+        """Show model suggestions and page through the most informative events first."""
+        global df
+        if enabled:
+            if self.learner is None:
+                columns = config.get('active_learning_features') or [
+                    c for c in df.columns if c != 'label' and pd.api.types.is_numeric_dtype(df[c])]
+                if not columns:
+                    logger.warning("No numeric feature columns to learn from")
+                    self.learnbutton.setChecked(False)
+                    return
+                names = [item['name'] for item in config['labels']]
+                rare = [names.index(name) for name in config.get('rare_labels', []) if name in names]
+                self.learner = ActiveLearner(
+                    df[columns].to_numpy(dtype=np.float32), len(config['labels']),
+                    rare_classes=rare, queue_size=config.get('active_learning_queue', 5000))
+                self.learner.signals.finished.connect(self.on_learner_updated)
+            self.save_labels()
+            self.learner.request_update(df.label.to_numpy(), self.reviewed)
+            logger.info("Active learning enabled")
+        else:
+            if self.nav_name == 'active learning':
+                self.set_navigation_order(None, None)
+            logger.info("Active learning disabled")
+
+    def on_learner_updated(self):
+        """Refresh suggestions and extend the queue past the current page."""
+        logger.debug(f"Active learner retrained on {self.learner.n_trained} events")
+        for w in self.page_tiles():
+            w.suggestion = self.get_suggestion(w.id)
+            w.update()
+        if self.gallerybutton.isChecked():
+            self.gallery.viewport().update()
+        if not self.learnbutton.isChecked():
+            return
+        if self.nav_name != 'active learning':
+            self.set_navigation_order(self.learner.queue, 'active learning')
+            return
+        # Pages up to the current one stay put so nothing moves under the user
+        keep = self.nav_order[:self.current_page * self.x_size * self.y_size]
+        queue = self.learner.queue[~np.isin(self.learner.queue, keep)]
+        self.nav_order = np.concatenate([keep, queue])
+        self.update_page_count()
+        self.update_page_number()
+
+    def set_labels(self, ids, label):
+        """Write one label to a batch of events and refresh what shows them."""
+        global df
+        ids = np.asarray(ids, dtype=np.int64)
+        ids = ids[ids < self.n_events]
+        if len(ids) == 0:
+            return
+        if self.in_review():
+            # Verdicts go to the review sidecar; the labels under review stay as they are
+            self.review.set_labels(ids, label)
+        else:
+            old_labels = df['label'].to_numpy()[ids]
+            df.iloc[ids, df.columns.get_loc('label')] = label
+            if self.journal is not None:
+                self.journal.record(ids, old_labels, label, self.current_page)
+            if self.label_stats is not None:
+                self.label_stats.update(old_labels, label)
+                if self.label_stats.needs_check():
+                    self.label_stats.check(df['label'].to_numpy())
+                self.refresh_statistics()
+            self.minimap.update_labels(ids, old_labels, label)
+        if self.gallerybutton.isChecked():
+            self.gallery.viewport().update()
+        else:
+            # Keep the widgets on the page in step with df
+            for id in set(ids.tolist()) & self.tiles_by_id.keys():
+                for w in self.tiles_by_id[id]:
+                    if w.label != label:
+                        w.label = label
+                        w.update()
+
+    def label_selection(self, ids):
+        """Apply the active label to a drag or shift-click selection in one write."""
+        ids = list(dict.fromkeys(int(i) for i in ids if i < self.n_events))
+        if not ids:
+            return
+        label = config['active_label']
+        self.record('label_selection', ids, label)
+        self.set_labels(ids, label)
+        logger.info(f"{len(ids)} events labelled {config['labels'][label]['name']}")
+
+    def refresh_statistics(self):
+        self.stats_panel.refresh(self.label_stats, len(self.completed_pages), self.n_pages)
+
+    def label_color(self, label):
+        """Qt colour used to draw the border of a tile with this label."""
+        return self.color_manager.color(label)
+
+    def build_embedding_index(self):
+        """Compute event embeddings in a background thread."""
+        global df
+        columns = [c for c in config.get('embedding_features', [])
+                   if c in df.columns and pd.api.types.is_numeric_dtype(df[c])]
+        features = df[columns].to_numpy(dtype=np.float32) if columns else None
+        index = EmbeddingIndex(n_components=config.get('embedding_components', 16))
+        self.embedding_index = index
+        self.embedding_thread = threading.Thread(target=self._build_embedding_index,
+                                                 args=(index, features), daemon=True)
+        self.embedding_thread.start()
+
+    def _build_embedding_index(self, index, features):
+        # Read from the coarsest pyramid level when one is available
+        path, key = self.f_path, config['image_key']
+        pyramid = self.image_cache.pyramid if self.image_cache else None
+        if pyramid is not None and pyramid.levels:
+            path, key = pyramid.path, f'level_{max(pyramid.levels)}'
+        logger.info(f"Building embedding index from {path}[{key}]")
+        try:
+            source = open_image_source(path, key)
+            try:
+                index.build(source, features)
+            finally:
+                source.close()
+            logger.info("Embedding index ready")
+        except Exception as e:
+            logger.error(f"Error building embedding index: {e}")
+
+    def wait_for_embedding_index(self):
+        """Build the index if needed and block until it is ready (replay only)."""
+        if self.embedding_index is None:
+            self.build_embedding_index()
+        self.embedding_thread.join()
+
+    def index_ready(self):
+        if self.embedding_index is None:
+            self.build_embedding_index()
+        if not self.embedding_index.ready:
+            logger.warning("Embedding index is still being built, try again shortly")
+            return False
+        return True
+
+    def show_tile_menu(self, id, global_pos):
+        """Context menu with similarity actions for one event."""
+        if id >= self.n_events:
+            return
+        k = config.get('knn_k', 50)
+        active_name = config['labels'][config['active_label']]['name']
+        menu = QMenu(self)
+        sort_action = menu.addAction(f"Sort by similarity to event {id}")
+        label_action = menu.addAction(f"Label {k} nearest neighbours as {active_name}")
+        action = menu.exec_(global_pos)
+        if action == sort_action:
+            self.sort_by_similarity(id)
+        elif action == label_action:
+            self.label_neighbours(id, k)
+
+    def sort_by_similarity(self, id):
+        if self.index_ready():
+            self.record('sort_by_similarity', id)
+            self.set_navigation_order(self.embedding_index.similarity_order(id),
+                                      f"similarity to event {id}")
+
+    def label_neighbours(self, id, k):
+        """Apply the active label to the k nearest neighbours of an event at once."""
+        if self.index_ready():
+            self.record('label_neighbours', id, k, config['active_label'])
+            ids = self.embedding_index.neighbours(id, k)
+            self.set_labels(ids, config['active_label'])
+            logger.info(f"Labelled {len(ids)} neighbours of event {id} as "
+                        f"{config['labels'][config['active_label']]['name']}")
+
+    def toggle_gallery(self, enabled):
+        """Switch between the paged grid and the continuous-scroll gallery."""
+        self.record('toggle_gallery', enabled)
+        if enabled:
+            # Commit the page before the gallery starts writing labels directly
+            self.save_labels()
+            self.gallery.setMinimumSize(self.grid_widget.minimumSize())
+            self.grid_widget.hide()
+            self.gallery.show()
+            self.gallery.scroll_to_position(
+                (self.current_page - 1) * self.x_size * self.y_size)
+            logger.info("Switched to gallery view")
+        else:
+            page_size = self.x_size * self.y_size
+            self.current_page = max(1, 1 + self.gallery.first_position() // page_size)
+            if self.image_cache:
+                self.image_cache.min_capacity = 0
+            self.gallery.hide()
+            self.grid_widget.show()
+            self.update_page_number()
+            self.reset_map()
+            logger.info("Switched to page view")
     
     def get_image(self, id, mode, channel_mode='composite'):
         if mode == 'rgb':
@@ -1062,18 +3507,43 @@ Grid Size:
                     qimg = QImage(arr.data, self.im_w, self.im_h, self.im_w * 3, QImage.Format_RGB888)
                     return qimg, arr
 
+    def event_tooltip(self, id):
+        """Event id, label and the tooltip_columns of one event."""
+        if id >= self.n_events:
+            return ""
+        label = self.get_label(id)
+        name = config['labels'][label]['name'] if label < len(config['labels']) else label
+        lines = [f"Event {id}", f"Label: {name}"]
+        for column in config.get('tooltip_columns', []):
+            if column not in self.tooltip_arrays:
+                if column not in df.columns:
+                    continue
+                self.tooltip_arrays[column] = df[column].to_numpy()
+            value = self.tooltip_arrays[column][id]
+            lines.append(f"{column}: {value:.4g}" if isinstance(value, (float, np.floating))
+                         else f"{column}: {value}")
+        return "\n".join(lines)
+
     def get_label(self, id):
         global df
         if id >= self.n_events:
             return 0
-        else:
-            return df.label.iat[id]
+        if self.in_review():
+            label = self.review.label_of(id)
+            if label is not None:
+                return label
+        return df.label.iat[id]
 
     def init_map(self):
         self.create_image_grid()
 
     def create_image_grid(self):
         """Create the image grid with selected channels."""
+        progressive = self.progressive_rendering()
+        if progressive:
+            # Tiles waiting for their image must not be evicted before they are shown
+            self.image_cache.min_capacity = self.x_size * self.y_size * len(self.selected_channels)
+        missing = []
         for y in range(0, self.y_size):
             for x in range(0, self.x_size):
                 id = self.calc_index(x, y)
@@ -1084,13 +3554,25 @@ Grid Size:
                 channel_layout.setSpacing(0)
                 channel_layout.setContentsMargins(0, 0, 0, 0)
                 
+                suggestion = self.get_suggestion(id)
                 for channel in self.selected_channels:
-                    qImage, arr = self.get_image(id, mode='rgb', channel_mode=channel)
+                    placeholder = (progressive and id < self.n_events
+                                   and self.image_cache.peek(id, channel) is None)
+                    if placeholder:
+                        qImage, arr = self.placeholder_image()
+                        missing.append(id)
+                    else:
+                        qImage, arr = self.get_image(id, mode='rgb', channel_mode=channel)
                     w = Pos(id, qImage, label)
+                    w.placeholder = placeholder
                     w.color_manager = self.color_manager
+                    w.suggestion = suggestion
+                    w.on_label_changed = self.set_labels
+                    w.cursor = self.cursor_mode and (x, y) == self.cursor_pos
                     w._qimage_buffer = arr
                     w._channel = channel
                     channel_layout.addWidget(w)
+                    self.tiles_by_id.setdefault(id, []).append(w)
                 
                 # Create container widget for this grid position
                 container = QWidget()
@@ -1103,6 +3585,10 @@ Grid Size:
                 container.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
                 self.grid.addWidget(container, y, x)
 
+        if self.image_cache:
+            # Read this page's tiles first, then whatever read-ahead was queued
+            self.image_cache.require(missing)
+
         # After building the grid, enforce the grid_widget minimum size so tiles don't shrink
         tile_size = config.get('tile_size', 85)
         num_channels = len(self.selected_channels)
@@ -1111,6 +3597,43 @@ Grid Size:
         if hasattr(self, 'grid_widget'):
             self.grid_widget.setMinimumSize(grid_width, grid_height)
 
+    def progressive_rendering(self):
+        """Whether the grid shows placeholders for cache misses instead of waiting."""
+        return (config.get('progressive_rendering', False) and self.image_cache is not None
+                and not self.gallerybutton.isChecked())
+
+    def placeholder_image(self):
+        """Shared dark tile drawn until an image has been read."""
+        if getattr(self, '_placeholder', None) is None or \
+                self._placeholder[1].shape[:2] != (self.im_h, self.im_w):
+            arr = np.full((self.im_h, self.im_w, 3), 40, dtype=np.uint8)
+            self._placeholder = (QImage(arr.data, self.im_w, self.im_h, self.im_w * 3,
+                                        QImage.Format_RGB888), arr)
+        return self._placeholder
+
+    def on_tiles_loaded(self, tiles):
+        """Swap placeholders for images that the background reader has just cached."""
+        if not self.image_cache:
+            return
+        if self.gallerybutton.isChecked():
+            # The gallery paints straight from the cache
+            self.gallery.viewport().update()
+            return
+        images = {(id, mode): image for id, mode, image in tiles}
+        for w in self.page_tiles():
+            if w.placeholder and (w.id, w._channel) in images:
+                image_data = images[(w.id, w._channel)]
+                if image_data is None:
+                    # Evicted before it could be handed over (rare); read this one tile now
+                    image_data = self.image_cache.get_image(w.id, w._channel)
+                    if image_data is None:
+                        continue
+                w._qimage_buffer = np.ascontiguousarray(image_data)
+                h, width = w._qimage_buffer.shape[:2]
+                w.image = QImage(w._qimage_buffer.data, width, h, width * 3, QImage.Format_RGB888)
+                w.placeholder = False
+                w.update()
+
     def refresh_display(self):
         """Refresh the entire display."""
         if hasattr(self, 'grid') and self.grid is not None:
@@ -1124,79 +3647,130 @@ Grid Size:
     def update_page_number(self):
         self.page_number.setText(f"{self.f_name}\n\n"
                                  f"{self.current_page} / {self.n_pages}")
+        self.minimap.update()
+
+    def go_to_page(self, page):
+        """Jump straight to a page, reading only the images shown on it."""
+        page = min(max(page, 1), self.n_pages)
+        self.record('go_to_page', page)
+        if self.gallerybutton.isChecked():
+            self.gallery.scroll_to_position((page - 1) * self.x_size * self.y_size)
+            return
+        if page == self.current_page:
+            return
+        self.save_labels(completed_page=self.current_page)
+        self.current_page = page
+        self.update_page_number()
+        logger.info(f"Page: {self.current_page}")
+        if self.image_cache:
+            # Read-ahead queued for the old position is no longer useful
+            self.image_cache.cancel_prefetch()
+            if not self.progressive_rendering():
+                self.image_cache.preload_ids(self.page_ids(page))
+        self.reset_map()
 
     def nextPage(self):
+        self.record('nextPage')
+        if self.gallerybutton.isChecked():
+            self.gallery.scroll_pages(1)
+            return
+        # The grid still shows the page being left
+        left_page = self.current_page
         if self.current_page < self.n_pages:
             self.current_page += 1
             self.update_page_number()
             logger.info(f"Page: {self.current_page}")
-            
-            # Preload next page images
-            if self.image_cache:
-                start_id = (self.current_page - 1) * self.x_size * self.y_size
-                end_id = min(start_id + self.x_size * self.y_size, self.n_events)
-                self.image_cache.preload_range(start_id, end_id)
+            self.schedule_prefetch(1)
         else:
             logger.warning("This is the last page!")
-        self.save_labels()
+        self.save_labels(completed_page=left_page)
         self.reset_map()
         
     def prevPage(self):
+        self.record('prevPage')
+        if self.gallerybutton.isChecked():
+            self.gallery.scroll_pages(-1)
+            return
+        # The grid still shows the page being left
+        left_page = self.current_page
         if self.current_page > 1:
             self.current_page -= 1
             self.update_page_number()
             logger.info(f"Page: {self.current_page}")
-            
-            # Preload previous page images
-            if self.image_cache:
-                start_id = (self.current_page - 1) * self.x_size * self.y_size
-                end_id = min(start_id + self.x_size * self.y_size, self.n_events)
-                self.image_cache.preload_range(start_id, end_id)
+            self.schedule_prefetch(-1)
         else:
             logger.warning("This is the first page!")
-        self.save_labels()
+        self.save_labels(completed_page=left_page)
         self.reset_map()
         
+    def schedule_prefetch(self, direction):
+        """Load the page just entered and read ahead in the direction of travel."""
+        if not self.image_cache:
+            return
+        ids = self.page_ids(self.current_page)
+        self.image_cache.count_hits(ids)
+        # With progressive rendering the grid requests its own misses
+        if not self.progressive_rendering():
+            self.image_cache.preload_ids(ids)
+        if self.nav_tracker.record(direction):
+            logger.debug("Navigation reversed, dropping queued prefetch")
+        # Never read further ahead than the cache can hold alongside the current page;
+        # the cache holds one entry per tile and channel
+        page_size = self.x_size * self.y_size * len(self.selected_channels)
+        depth = max(0, min(self.nav_tracker.depth(),
+                           self.image_cache.cache_size // page_size - 1))
+        ahead = []
+        # Nearest page first, so it is ready before the ones behind it
+        for step in range(1, depth + 1):
+            page = self.current_page + direction * step
+            if 1 <= page <= self.n_pages:
+                ahead.extend(self.page_ids(page))
+        # A new request supersedes queued work, including reads in the old direction
+        self.image_cache.prefetch(ahead)
+        logger.debug(f"Prefetching {depth} page(s) {'ahead' if direction > 0 else 'behind'}, "
+                     f"hit rate {100 * self.image_cache.hit_rate():.1f}%")
+
     def selectAll(self):
-        for x in range(0, self.x_size):
-            for y in range(0, self.y_size):
-                container = self.grid.itemAtPosition(y, x).widget()
-                if container:
-                    # Apply to all Pos widgets in the container
-                    channel_layout = container.layout()
-                    if channel_layout:
-                        for i in range(channel_layout.count()):
-                            w = channel_layout.itemAt(i).widget()
-                            if hasattr(w, 'flag'):
-                                w.flag()
-                
+        self.record('selectAll', config['active_label'])
+        if self.gallerybutton.isChecked():
+            self.set_labels(self.gallery.visible_ids(), config['active_label'])
+            return
+        # One write for the whole page
+        self.set_labels(list(self.tiles_by_id), config['active_label'])
+        logger.info(f"Page labelled {config['labels'][config['active_label']]['name']}")
+
     def selectNone(self):
-        for x in range(0, self.x_size):
-            for y in range(0, self.y_size):
-                container = self.grid.itemAtPosition(y, x).widget()
-                if container:
-                    # Apply to all Pos widgets in the container
-                    channel_layout = container.layout()
-                    if channel_layout:
-                        for i in range(channel_layout.count()):
-                            w = channel_layout.itemAt(i).widget()
-                            if hasattr(w, 'junk'):
-                                w.junk()
-                
-    def save_labels(self):
+        self.record('selectNone')
+        if self.gallerybutton.isChecked():
+            self.set_labels(self.gallery.visible_ids(), 0)
+            return
+        self.set_labels(list(self.tiles_by_id), 0)
+        logger.info("Page discarded")
+
+    def save_labels(self, completed_page=None):
+        """Commit the grid's labels; completed_page is the page being turned away from."""
         global df
-        for x in range(0, self.x_size):
-            for y in range(0, self.y_size):
-                container = self.grid.itemAtPosition(y, x).widget()
-                if container:
-                    # Get the first Pos widget from the container (they all have the same id and label)
-                    channel_layout = container.layout()
-                    if channel_layout and channel_layout.count() > 0:
-                        w = channel_layout.itemAt(0).widget()
-                        if hasattr(w, 'id') and w.id < self.n_events:
-                            df.label.iat[w.id] = w.label
-                
-        logger.info(f"Selection: {sum(df.label)}")
+        # The gallery writes labels straight to df; the hidden grid is stale
+        if self.gallerybutton.isChecked():
+            return
+        for id, tiles in self.tiles_by_id.items():
+            # All channels of a tile carry the same label
+            w = tiles[0]
+            if id < self.n_events:
+                # Tiles normally write through set_labels already
+                if self.get_label(id) != w.label:
+                    self.set_labels([id], w.label)
+                if self.in_review():
+                    # Tiles left alone on a turned page confirm the label
+                    self.review.mark_reviewed([id])
+                else:
+                    self.reviewed[id] = True
+
+        if self.learner is not None and self.learnbutton.isChecked():
+            self.learner.request_update(df.label.to_numpy(), self.reviewed)
+        if self.label_stats is not None and completed_page is not None:
+            self.completed_pages.add(completed_page)
+            self.refresh_statistics()
 
     def open_settings(self):
         main_dialog = QDialog()
@@ -1240,41 +3814,201 @@ Grid Size:
             self.image_cache.clear_cache()
             logger.info("Image cache cleared to free memory")
 
-    def load_data(self, init_map=False):
+    def toggle_profiler(self):
+        """Start profiling, or stop and write hotspot, allocation and cache reports."""
+        if not self.profiler.running:
+            self.profiler.start()
+            logger.info("Profiling started, press Ctrl+Shift+P again to stop")
+            return
+        path = os.path.join(config['output_dir'],
+                            f"{self.f_name}.profile.{time.strftime('%Y%m%d-%H%M%S')}.txt")
+        os.makedirs(config['output_dir'], exist_ok=True)
+        self.profiler.stop(path, [('Image cache', self.cache_report()),
+                                  ('Live widgets', self.widget_report())])
+        logger.info(f"Profile written to {path}")
+
+    def cache_report(self):
+        cache = self.image_cache
+        if cache is None:
+            return ["no image cache"]
+        with cache.lock:
+            n_bytes = sum(a.nbytes for a in cache.cache.values() if a is not None)
+            return [f"type: {type(cache).__name__}",
+                    f"entries: {len(cache.cache)}",
+                    f"cache_size: {cache.cache_size} (max {cache.max_cache_size}, "
+                    f"min_capacity {cache.min_capacity})",
+                    f"memory: {n_bytes / 2**20:.1f} MB",
+                    f"hit rate: {100 * cache.hit_rate():.1f}% "
+                    f"({cache.hits} hits, {cache.misses} misses)",
+                    f"pyramid level: 1/{cache.level}",
+                    f"memory status: {read_memory_status()}"]
+
+    def widget_report(self):
+        counts = {}
+        for widget in QApplication.allWidgets():
+            name = type(widget).__name__
+            counts[name] = counts.get(name, 0) + 1
+        # More Pos widgets than the grid shows means some were never deleted
+        expected = self.x_size * self.y_size * len(self.selected_channels)
+        lines = [f"Pos widgets: {counts.get('Pos', 0)} (grid shows {expected})"]
+        lines += [f"{name}: {n}" for name, n in sorted(counts.items(), key=lambda item: -item[1])]
+        return lines
+
+    def record(self, action, *args):
+        """Add a user action to the trace if recording."""
+        if self.recorder is not None:
+            self.recorder.record(action, args)
+
+    @contextmanager
+    def recording_as(self, action, *args):
+        """Record one action and leave out the actions it triggers, which replay redoes."""
+        self.record(action, *args)
+        recorder, self.recorder = self.recorder, None
+        try:
+            yield
+        finally:
+            self.recorder = recorder
+
+    def replay_action(self, action, args):
+        """Perform a recorded action the way the user did."""
+        if action in ('flag', 'junk'):
+            if action == 'flag':
+                config['active_label'] = args[1]
+            # Gallery clicks have no tile widget
+            tile = None if self.gallerybutton.isChecked() else next(
+                (w for w in self.page_tiles() if w.id == args[0]), None)
+            if tile is not None:
+                getattr(tile, action)()
+            else:
+                self.set_labels([args[0]], args[1] if action == 'flag' else 0)
+        elif action == 'on_channel_changed':
+            for channel, checkbox in self.channel_checkboxes.items():
+                checkbox.blockSignals(True)
+                checkbox.setChecked(channel in args[0])
+                checkbox.blockSignals(False)
+            self.on_channel_changed()
+        elif action == 'apply_grid_changes':
+            config['x_size'], config['y_size'], config['tile_size'] = args
+            self.apply_grid_changes()
+        elif action == 'selectAll':
+            config['active_label'] = args[0]
+            self.selectAll()
+        elif action == 'label_selection':
+            config['active_label'] = args[1]
+            self.label_selection(args[0])
+        elif action == 'go_to_page':
+            self.go_to_page(args[0])
+        elif action == 'move_cursor':
+            self.move_cursor(*args)
+        elif action == 'label_at_cursor':
+            self.label_at_cursor(args[0])
+        elif action == 'toggle_gallery':
+            self.gallerybutton.setChecked(args[0])
+        elif action in ('sort_by_similarity', 'label_neighbours'):
+            self.wait_for_embedding_index()
+            if action == 'sort_by_similarity':
+                self.sort_by_similarity(args[0])
+            else:
+                config['active_label'] = args[2]
+                self.label_neighbours(args[0], args[1])
+        else:
+            getattr(self, action)()
+
+    def check_memory(self):
+        """Adapt the image cache budget to current memory pressure."""
+        status = read_memory_status()
+        if status is None or not getattr(self, 'image_cache', None):
+            return
+        rss_limit = config.get('cache_rss_limit_mb', 0) * 2**20 or None
+        self.image_cache.adapt_to_memory(status, low=config.get('memory_low_fraction', 0.10),
+                                         high=config.get('memory_high_fraction', 0.25),
+                                         rss_limit=rss_limit)
+
+    def load_data(self, init_map=False, f_path=None):
         global images
         global df
 
-        self.f_path, _ = self.dialog.getOpenFileName(
-            self.loadbutton, "Open File", '', "HDF files (*.hdf5)")
+        # Leaving the current file, remember where we were in it
+        if getattr(self, 'image_cache', None):
+            self.save_session()
+        if self.review is not None:
+            self.save_review()
+        if self.journal is not None:
+            self.journal.flush()
+
+        self.f_path = f_path or self.dialog.getOpenFileName(
+            self.loadbutton, "Open File", '', "HDF files (*.hdf5)")[0]
 
         if not self.f_path:
             return
+        # Release the previous file so it can be written or reopened
+        if self.image_cache is not None:
+            self.image_cache.close()
+        # Retire everything tied to the previous file before df is replaced
+        if self.learner is not None:
+            self.learner.shutdown()
+        self.learner = None
+        # Quietly: toggling off would reset the order and save the grid's tiles
+        self.learnbutton.blockSignals(True)
+        self.learnbutton.setChecked(False)
+        self.learnbutton.blockSignals(False)
+        self.review = None
+        # The old tiles must never be saved into the new file's labels
+        self.clear_grid()
         try:
             self.f_name = os.path.basename(self.f_path).replace('.hdf5', '')
             logger.info(f"loading input data from: {self.f_path}")
 
-            # Initialize image cache manager
+            # Initialize image cache manager; images may live outside the HDF5 file
+            image_path = config.get('image_path') or self.f_path
             cache_size = config.get('image_cache_size', 100)
-            self.image_cache = ImageCacheManager(self.f_path, config['image_key'], cache_size=cache_size)
+            self.image_cache = None
+            if config.get('tile_server'):
+                try:
+                    self.image_cache = TileClientCacheManager(
+                        config['tile_server'], image_path, config['image_key'],
+                        cache_size=cache_size, memmap=config.get('memmap_images', False),
+                        key_path=config.get('tile_server_key'))
+                    logger.info(f"Connected to tile server at {config['tile_server']}")
+                except (OSError, AuthenticationError) as e:
+                    logger.warning(f"Tile server at {config['tile_server']} unavailable ({e}), "
+                                   f"reading images locally")
+            if self.image_cache is None:
+                self.image_cache = ImageCacheManager(image_path, config['image_key'], cache_size=cache_size,
+                                                     memmap=config.get('memmap_images', False))
+            self.image_cache.set_display_size(config['tile_size'])
+            self.image_cache.signals.loaded.connect(self.on_tiles_loaded)
             
             # Load data (not images - they'll be loaded dynamically)
             with h5py.File(self.f_path, 'r') as file:
                 self.input_keys = list(file.keys())
                 logger.debug(f"Input file keys: {self.input_keys}")
                 
-                # Get image shape without loading all images
-                if config['image_key'] in self.input_keys:
-                    with h5py.File(self.f_path, 'r') as f:
-                        image_dataset = f[config['image_key']]
-                        self.im_shape = image_dataset.shape
-                        logger.info(f"Image dataset shape: {self.im_shape}")
-                else:
-                    logger.error("Images not found in input file!")
-                    sys.exit(-1)
+            # Get image shape without loading all images
+            if image_path != self.f_path or config['image_key'] in self.input_keys:
+                self.image_cache.open_file()
+                self.im_shape = self.image_cache.image_shape
+                logger.info(f"Image dataset shape: {self.im_shape}")
+            else:
+                logger.error("Images not found in input file!")
+                sys.exit(-1)
+
+            if config.get('thumbnail_pyramid', False):
+                pyramid_dir = config.get('cache_dir', config['output_dir'])
+                self.image_cache.enable_pyramid(
+                    os.path.join(pyramid_dir, f"{self.f_name}.{config['image_key']}.pyramid.hdf5"),
+                    factors=config.get('pyramid_factors', [2, 4]))
 
             if config['data_key'] in self.input_keys:
                 df = pd.read_hdf(self.f_path, config['data_key'])
                 logger.info(f"Loaded data with size: {df.shape}")
+                self.compaction = None
+                if config.get('compact_features', False):
+                    self.compaction = compact_features(df, config.get('compact_tolerance', 0.0))
+                    logger.info(f"Compacted features from {self.compaction.bytes_before / 2**20:.1f} MB "
+                                f"to {self.compaction.bytes_after / 2**20:.1f} MB "
+                                f"({len(self.compaction.dtypes)} columns, "
+                                f"{len(self.compaction.lossy)} within tolerance)")
                 logger.debug(f"Types of data columns:\n{df.dtypes}")
             else:
                 logger.info(f"Data not found in input file!")
@@ -1288,41 +4022,315 @@ Grid Size:
         self.im_h       = self.im_shape[1]
         self.im_w       = self.im_shape[2]
         self.n_channels = self.im_shape[3]
-        self.n_pages    = 1 + self.n_events // (self.x_size * self.y_size)
-        self.n_tiles    = self.n_pages * (self.x_size * self.y_size)
+        self.nav_order  = None
+        self.nav_name   = 'storage order'
+        self.update_page_count()
 
         # Ensure we start from page 1 before any preloading
         self.current_page = 1
 
         # Set up channel controls based on available channels
         self.setup_channel_controls()
+
+        # Jump back to where the last session on this file stopped
+        hot_ids = self.restore_session()
         
-        # Preload first page of images for better performance
+        # Preload the first page shown, then refill the rest of the cache in the background
         if self.image_cache:
-            start_id = (self.current_page - 1) * self.x_size * self.y_size
-            end_id = min(start_id + self.x_size * self.y_size, self.n_events)
-            self.image_cache.preload_range(start_id, end_id)
+            if not self.progressive_rendering():
+                self.image_cache.preload_ids(self.page_ids(self.current_page))
+            if hot_ids:
+                self.image_cache.prefetch(hot_ids[:self.image_cache.cache_size])
 
         if 'label' not in df.columns:
             df['label'] = np.zeros(self.n_events, dtype='uint8')
 
+        if config.get('label_storage', 'inplace') == 'sidecar' and self.label_sidecar().exists():
+            labels, _, _ = self.label_sidecar().load()
+            if len(labels) == self.n_events:
+                df['label'] = labels
+                logger.info(f"Loaded labels from {self.label_sidecar().path}")
+            else:
+                logger.warning(f"Ignoring {self.label_sidecar().path}: "
+                               f"{len(labels)} labels for {self.n_events} events")
+
+        self.journal = None
+        if config.get('annotation_journal', False):
+            # Beside the outputs, since the data directory may be read-only
+            self.journal = AnnotationJournal(sidecar_path(
+                self.f_path, 'journal', self.annotator(),
+                config.get('journal_dir', config['output_dir'])))
+
+        self.reviewed = np.zeros(self.n_events, dtype=bool)
+        self.label_stats = LabelStatistics(df['label'].to_numpy(), len(config['labels']),
+                                           config.get('stats_check_interval', 1000))
+        self.completed_pages = set()
+        self.refresh_statistics()
+        self.refresh_minimap()
+
+        self.tooltip_arrays = {}
+        self.embedding_index = None
+        if config.get('embedding_index', False):
+            self.build_embedding_index()
+
         self.update_page_number()
         if init_map:
             self.init_map()
         else:
             self.reset_map()
+        if self.gallerybutton.isChecked():
+            self.gallery.scroll_to_position(0)
 
-    def save_data(self, export_txt=True):
+    def save_data(self, export_txt=None):
         global df
+        self.record('save_data')
         self.save_labels()
+        self.save_session()
+        if self.review is not None:
+            self.save_review()
+        export_format = config.get('export_format', 'tsv')
+        if export_txt is None:
+            export_txt = export_format == 'tsv'
         
+        if config.get('label_storage', 'inplace') == 'sidecar':
+            # The source file stays read-only; labels go to this annotator's sidecar
+            try:
+                self.label_sidecar().save(
+                    df.label.to_numpy(), [item['name'] for item in config['labels']],
+                    self.annotator(), self.f_path)
+                logger.info(f"Stored labels in {self.label_sidecar().path}")
+            except Exception as e:
+                logger.error(f"Error saving label sidecar: {e}")
+                raise
+        else:
+            self.save_inplace()
+        # Only after the labels themselves are safe
+        if self.journal is not None:
+            self.journal.flush()
+        # exporting data to a txt file if requested
+        if export_txt:
+            self.export_tsv()
+        elif export_format in ('parquet', 'feather'):
+            self.export_columnar(export_format)
+
+    def export_tsv(self):
+        global df
+        self.save_labels()
+        export_path = f"{config['output_dir']}/{self.f_name}.txt"
+        self.full_features().to_csv(export_path, index=False, sep='\t')
+        logger.info(f"Exported data to {export_path}")
+
+    def export_columnar(self, export_format):
+        """Write features once and only the small labels table on every save.
+
+        Both tables carry an event_id column to join them on.
+        """
+        global df
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            import pyarrow.feather as feather
+        except ImportError:
+            logger.error(f"{export_format} export needs the pyarrow package")
+            return
+
+        def write(table, path):
+            # Readers never see a half-written file
+            tmp_path = path + '.tmp'
+            if export_format == 'parquet':
+                pq.write_table(table, tmp_path)
+            else:
+                feather.write_feather(table, tmp_path)
+            os.replace(tmp_path, path)
+
+        def n_rows(path):
+            if export_format == 'parquet':
+                return pq.read_metadata(path).num_rows
+            return feather.read_table(path, columns=['event_id'], memory_map=True).num_rows
+
+        event_id = pa.array(np.arange(len(df), dtype=np.int64))
+        features_path = f"{config['output_dir']}/{self.f_name}.features.{export_format}"
+        if not os.path.exists(features_path) or n_rows(features_path) != len(df):
+            features = pa.Table.from_pandas(self.full_features().drop(columns=['label']),
+                                            preserve_index=False)
+            write(features.add_column(0, 'event_id', event_id), features_path)
+            logger.info(f"Exported features to {features_path}")
+        labels_path = f"{config['output_dir']}/{self.f_name}.labels.{export_format}"
+        write(pa.table({'event_id': event_id, 'label': df['label'].to_numpy()}), labels_path)
+        logger.info(f"Exported labels to {labels_path}")
+
+    def export_labelled(self):
+        """Stream labelled events into per-class shards in a background thread."""
+        global df
+        self.save_labels()
+        out_dir = os.path.join(config['output_dir'], f"{self.f_name}_shards")
+        labels = df['label'].to_numpy().copy()
+        names = [item['name'] for item in config['labels']]
+        threading.Thread(target=self._export_labelled,
+                         args=(labels, self.full_features(), names, out_dir),
+                         daemon=True).start()
+
+    def _export_labelled(self, labels, features, names, out_dir):
+        logger.info(f"Exporting labelled events to {out_dir}")
+        try:
+            # A separate reader so the export does not contend for the cache lock
+            source = open_image_source(self.image_cache.file_path, config['image_key'])
+            try:
+                shards = export_shards(
+                    source, labels, features, names, out_dir,
+                    fmt=config.get('export_shard_format', 'hdf5'),
+                    shard_size=config.get('export_shard_size', 10000),
+                    workers=config.get('export_workers', 2),
+                    progress=log_progress("Export"))
+            finally:
+                source.close()
+            logger.info(f"Exported {len(shards)} shards to {out_dir}")
+        except Exception as e:
+            logger.error(f"Error exporting shards: {e}")
+
+    def annotator(self):
+        return config.get('annotator') or getpass.getuser()
+
+    def session_state(self):
+        return SessionState(sidecar_path(self.f_path, 'session', self.annotator(),
+                                         config.get('cache_dir', config['output_dir'])))
+
+    def save_session(self):
+        """Remember the position in this file for the next launch."""
+        if not config.get('warm_restart', False) or not getattr(self, 'n_events', 0):
+            return
+        try:
+            os.makedirs(os.path.dirname(self.session_state().path), exist_ok=True)
+            self.session_state().save(
+                self.n_events, self.current_page, (self.x_size, self.y_size, config['tile_size']),
+                self.selected_channels, self.nav_name, self.nav_order,
+                self.image_cache.hot_ids() if self.image_cache else [])
+            logger.debug(f"Saved session state to {self.session_state().path}")
+        except OSError as e:
+            logger.warning(f"Could not save session state: {e}")
+
+    def restore_session(self):
+        """Return to the page, grid, channels and order of the last session on this file."""
+        state = self.session_state()
+        if not config.get('warm_restart', False) or not state.exists():
+            return []
+        try:
+            session = state.load()
+        except (OSError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable session state {state.path}: {e}")
+            return []
+        if session['n_events'] != self.n_events:
+            logger.warning(f"Ignoring session state for {session['n_events']} events, "
+                           f"file has {self.n_events}")
+            return []
+        x_size, y_size, tile_size = session['grid']
+        for spinbox, value in ((self.x_spinbox, x_size), (self.y_spinbox, y_size),
+                               (self.tile_spinbox, tile_size)):
+            spinbox.blockSignals(True)
+            spinbox.setValue(value)
+            spinbox.blockSignals(False)
+        config['x_size'], config['y_size'], config['tile_size'] = x_size, y_size, tile_size
+        self.x_size, self.y_size = x_size, y_size
+        self.image_cache.set_display_size(tile_size)
+        self.cursor_pos = (min(self.cursor_pos[0], x_size - 1), min(self.cursor_pos[1], y_size - 1))
+        channels = [c for c in session['channels'] if c in self.channel_checkboxes] or ['composite']
+        for channel, checkbox in self.channel_checkboxes.items():
+            checkbox.blockSignals(True)
+            checkbox.setChecked(channel in channels)
+            checkbox.blockSignals(False)
+        self.selected_channels = channels
+        self.image_cache.set_selected_channels(channels)
+        if session['nav_order'] is not None:
+            self.nav_order = session['nav_order'].astype(np.int64)
+            self.nav_name = session['nav_name']
+        self.update_page_count()
+        self.current_page = min(max(session['page'], 1), self.n_pages)
+        logger.info(f"Resuming at page {self.current_page} of {self.n_pages} ({self.nav_name})")
+        return [int(i) for i in session['hot_ids']]
+
+    def full_features(self):
+        """The features table as stored, undoing any compaction applied on load."""
+        if getattr(self, 'compaction', None) is None or \
+                (not self.compaction.dtypes and not self.compaction.lossy):
+            return df
+        return self.compaction.restore(df, self.f_path, config['data_key'])
+
+    def in_review(self):
+        """Whether the grid currently shows the QA review sample."""
+        return self.review is not None and self.nav_name == 'QA review'
+
+    def toggle_review(self):
+        if self.review is None:
+            self.start_review()
+        else:
+            self.end_review()
+
+    def start_review(self):
+        """Page through a stratified sample of each class, resuming an unfinished review."""
+        global df
+        if self.gallerybutton.isChecked():
+            self.gallerybutton.setChecked(False)
+        path = sidecar_path(self.f_path, 'review', self.annotator(), config.get('sidecar_dir'))
+        if os.path.exists(path):
+            review = ReviewSidecar.load(path)
+            logger.info(f"Resuming QA review of {len(review.ids)} events from {path}")
+        else:
+            names = [item['name'] for item in config['labels']]
+            classes = [names.index(name) for name in config.get('review_classes', []) if name in names]
+            labels = df['label'].to_numpy()
+            if not classes:
+                classes = [c for c in np.unique(labels) if c != 0]
+            source = getattr(self.image_cache, 'source', None)
+            block_rows = getattr(source, 'chunk_rows', None) or config.get('review_block_rows', 64)
+            ids, strata, weights = stratified_sample(
+                labels, block_rows, classes, count=config.get('review_count'),
+                fraction=config.get('review_fraction', 0.05),
+                per_block=config.get('review_per_block', 8), seed=config.get('review_seed'))
+            if len(ids) == 0:
+                logger.warning("Nothing to review: no labelled events in the review classes")
+                return
+            review = ReviewSidecar(path, ids, strata, weights)
+            logger.info(f"Sampled {len(ids)} events from {len(np.unique(strata))} classes "
+                        f"in blocks of {block_rows} for QA review")
+        # Flush the current page as ordinary labels before switching
+        self.save_labels()
+        self.review = review
+        self.set_navigation_order(review.ids, 'QA review')
+
+    def end_review(self):
+        """Store the verdicts, log the per-class agreement and return to storage order."""
+        if self.in_review():
+            self.set_navigation_order(None, None)
+        self.save_review()
+        self.review = None
+
+    def save_review(self):
+        try:
+            self.review.save(self.annotator(), self.f_path)
+        except OSError as e:
+            logger.error(f"Could not save review to {self.review.path}: {e}")
+            return
+        names = [item['name'] for item in config['labels']]
+        for c, stats in self.review.report().items():
+            name = names[c] if c < len(names) else c
+            logger.info(f"{name:>12}: reviewed {stats['reviewed']}/{stats['sampled']}, "
+                        f"weighted agreement {100 * stats['agreement']:6.2f}%")
+        logger.info(f"Stored review in {self.review.path}")
+
+    def label_sidecar(self):
+        return LabelSidecar(sidecar_path(
+            self.f_path, 'labels', self.annotator(), config.get('sidecar_dir')))
+
+    def save_inplace(self):
+        """Rewrite the features table and label keymap inside the source file."""
+        global df
         # Close any open file handles before saving
         if hasattr(self, 'image_cache') and self.image_cache is not None:
             self.image_cache.close_file()
         
         # saving annotations to hdf5 file
         try:
-            df.to_hdf(self.f_path, key=config['data_key'], mode='r+')
+            self.full_features().to_hdf(self.f_path, key=config['data_key'], mode='r+')
             # saving label keymap
             with h5py.File(self.f_path, 'r+') as file:
                 if 'labels' in file.keys():
@@ -1337,11 +4345,6 @@ Grid Size:
             # Reopen the image cache after saving
             if hasattr(self, 'image_cache') and self.image_cache is not None:
                 self.image_cache.open_file()
-        # exporting data to a txt file if requested
-        if export_txt:
-            export_path = f"{config['output_dir']}/{self.f_name}.txt"
-            df.to_csv(export_path, index=False, sep='\t')
-            logger.info(f"Exported data to {export_path}")
 
     def closeEvent(self,event):
         result = QMessageBox.question(self,
@@ -1351,9 +4354,17 @@ Grid Size:
         event.ignore()
 
         if result == QMessageBox.Yes:
+            self.save_session()
+            if self.journal is not None:
+                self.journal.flush()
+                log_journal_report(journal_report(self.journal.load(), len(config['labels'])),
+                                   [item['name'] for item in config['labels']])
             # Clean up image cache
             if self.image_cache:
-                self.image_cache.close_file()
+                logger.info(f"Prefetch hit rate: {100 * self.image_cache.hit_rate():.1f}% "
+                            f"({self.image_cache.hits} of "
+                            f"{self.image_cache.hits + self.image_cache.misses} images)")
+                self.image_cache.close()
             event.accept()
 
 # Functions
@@ -1373,10 +4384,168 @@ def save_config():
     
 
 
+def merge_command(args):
+    """Combine annotator sidecars into a consensus sidecar and log agreement."""
+    consensus, support, names, report = merge_label_sidecars(args.sidecars)
+    with h5py.File(args.output, 'w') as file:
+        file.create_dataset('label', data=consensus, compression='gzip')
+        file.create_dataset('support', data=support, compression='gzip')
+        file.create_dataset('labels', data=names)
+        file.attrs['annotator'] = 'consensus'
+        file.attrs['sources'] = [os.path.abspath(path) for path in args.sidecars]
+    logger.info(f"Merged {len(args.sidecars)} sidecars ({', '.join(report['annotators'])}) "
+                f"over {report['n_events']} events into {args.output}")
+    logger.info(f"Unanimous: {100 * report['unanimous']:.2f}%")
+    if 'kappa' in report:
+        logger.info(f"Fleiss' kappa: {report['kappa']:.3f}")
+    for name, stats in report['classes'].items():
+        logger.info(f"{name:>12}: consensus {stats['consensus']:>9}  "
+                    f"any {stats['any']:>9}  agreement {100 * stats['agreement']:6.2f}%")
+
+
+def export_command(args):
+    """Headless version of the Export button."""
+    features = pd.read_hdf(args.file, args.data_key)
+    if args.labels:
+        labels, names, _ = LabelSidecar(args.labels).load()
+    else:
+        labels = features['label'].to_numpy()
+        with h5py.File(args.file, 'r') as file:
+            names = ([n.decode() if isinstance(n, bytes) else n for n in file['labels'][()]]
+                     if 'labels' in file else [])
+    source = open_image_source(args.image_path or args.file, args.image_key)
+    try:
+        shards = export_shards(source, labels, features, names, args.output,
+                               fmt=args.format, shard_size=args.shard_size,
+                               batch_size=args.batch_size, workers=args.workers,
+                               progress=log_progress("Export"))
+    finally:
+        source.close()
+    logger.info(f"Exported {len(shards)} shards to {args.output}")
+
+
+def serve_command(args):
+    """Run a tile server until interrupted."""
+    server = TileServer(args.socket, cache_size=args.cache_size, memmap=not args.no_memmap,
+                        key_path=args.key_file, roots=args.root)
+    try:
+        server.serve_forever()
+    except FileExistsError as e:
+        logger.error(str(e))
+    except KeyboardInterrupt:
+        logger.info("Tile server stopped")
+
+
+def replay_command(args):
+    """Replay a recorded trace headless and report per-action latencies."""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    load_config()
+    # Never touch the source file or the annotator's own sidecars and sessions
+    output_dir = args.output_dir or os.path.join(config['output_dir'], 'replay')
+    os.makedirs(output_dir, exist_ok=True)
+    config.update({'output_dir': output_dir, 'sidecar_dir': output_dir, 'cache_dir': output_dir,
+                   'label_storage': 'sidecar', 'annotator': 'replay', 'warm_restart': False})
+    trace = load_trace(args.trace)
+    app = QApplication([])
+    window = MainWindow(f_path=args.file)
+    latencies = {}
+    start = time.monotonic()
+    for entry in trace:
+        if args.realtime:
+            # Keep the user's pacing so prefetching sees the same idle gaps
+            time.sleep(max(0.0, entry['t'] - (time.monotonic() - start)))
+        if entry['action'] in ('sort_by_similarity', 'label_neighbours'):
+            # The user could only do this once the index was ready; building it is not latency
+            window.wait_for_embedding_index()
+        began = time.perf_counter()
+        window.replay_action(entry['action'], entry['args'])
+        # Include the repaint the action caused
+        app.processEvents()
+        latencies.setdefault(entry['action'], []).append(time.perf_counter() - began)
+    report = latency_report(latencies)
+    for action, stats in report.items():
+        logger.info(f"{action:>20}: n={stats['n']:<6} mean {stats['mean']:8.1f} ms  "
+                    f"p50 {stats['p50']:8.1f}  p90 {stats['p90']:8.1f}  "
+                    f"p99 {stats['p99']:8.1f}  max {stats['max']:8.1f}")
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+    if window.image_cache:
+        window.image_cache.close()
+
+
+def journal_command(args):
+    """Throughput and relabel statistics for one or more annotation journals."""
+    for path in args.journals:
+        rows = AnnotationJournal(path).load()
+        logger.info(f"{path}:")
+        n_classes = int(rows['new'].max()) + 1 if len(rows) else 0
+        log_journal_report(journal_report(rows, n_classes, idle=args.idle))
+
+
 def main():
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Image annotation tool for HDF5 datasets.")
+    parser.add_argument('--record', metavar='TRACE', help="append user actions to a JSONL trace")
+    commands = parser.add_subparsers(dest='command')
+    merge_parser = commands.add_parser('merge', help="merge per-annotator label sidecars")
+    merge_parser.add_argument('sidecars', nargs='+')
+    merge_parser.add_argument('-o', '--output', required=True)
+    export_parser = commands.add_parser('export', help="export labelled events into per-class shards")
+    export_parser.add_argument('file')
+    export_parser.add_argument('-o', '--output', required=True)
+    export_parser.add_argument('--labels', help="label sidecar to use instead of the label column")
+    export_parser.add_argument('--format', choices=['hdf5', 'npy'], default='hdf5')
+    export_parser.add_argument('--shard-size', type=int, default=10000)
+    export_parser.add_argument('--batch-size', type=int, default=1024)
+    export_parser.add_argument('--workers', type=int, default=2)
+    export_parser.add_argument('--image-key', default='images')
+    export_parser.add_argument('--image-path')
+    export_parser.add_argument('--data-key', default='features')
+    serve_parser = commands.add_parser('serve', help="serve rendered tiles to GUIs on this machine")
+    serve_parser.add_argument('--socket', default='/tmp/annotateEZ-tiles.sock')
+    serve_parser.add_argument('--cache-size', type=int, default=20000)
+    serve_parser.add_argument('--no-memmap', action='store_true')
+    serve_parser.add_argument('--key-file', help="shared key clients must know "
+                                                 "(default: <socket>.key, created if missing)")
+    serve_parser.add_argument('--root', action='append',
+                              help="directory clients may open files from "
+                                   "(repeatable, default: current directory)")
+    replay_parser = commands.add_parser('replay', help="replay a recorded trace and report latencies")
+    replay_parser.add_argument('trace')
+    replay_parser.add_argument('file')
+    replay_parser.add_argument('--realtime', action='store_true',
+                               help="keep the recorded pauses between actions")
+    replay_parser.add_argument('--output-dir', help="where saves go (default: output_dir/replay)")
+    replay_parser.add_argument('--json', help="also write the latency report as JSON")
+    journal_parser = commands.add_parser('journal', help="report labelling throughput from journals")
+    journal_parser.add_argument('journals', nargs='+')
+    journal_parser.add_argument('--idle', type=float, default=300.0,
+                                help="gaps longer than this many seconds count as breaks")
+    args = parser.parse_args()
+
+    if args.command == 'merge':
+        merge_command(args)
+        return
+    if args.command == 'export':
+        export_command(args)
+        return
+    if args.command == 'serve':
+        serve_command(args)
+        return
+    if args.command == 'replay':
+        replay_command(args)
+        return
+    if args.command == 'journal':
+        journal_command(args)
+        return
+
     load_config()
     app = QApplication([])
     window = MainWindow()
+    if args.record:
+        window.recorder = TraceRecorder(args.record)
+        logger.info(f"Recording user actions to {args.record}")
     ret = app.exec_()
     sys.exit(ret)
 
@@ -1389,12 +4558,9 @@ if __name__ == '__main__':
 ## Next Versions:
 
 # Change it to dark theme
-# Scale images
 # Improve images
 # Add option 3-color or gray-scale
-# Add multiple selection by dragging mouse click
 # Filter using size
-# Show event data while hovering cursor over the item and waiting
 
 
 ##### To be used later
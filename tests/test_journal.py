@@ -0,0 +1,33 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from annotateEZ import AnnotationJournal
+
+
+def test_batch_crossing_buffer_boundary_keeps_every_row(tmp_path):
+    journal = AnnotationJournal(str(tmp_path / 'data.journal.test.hdf5'), buffer_size=10)
+    journal.record(np.arange(8), np.zeros(8, dtype=np.int16), 1, page=1)
+    journal.record(np.arange(8, 13), np.zeros(5, dtype=np.int16), 1, page=2)
+    journal.flush()
+    rows = journal.load()
+    assert len(rows) == 13
+    assert sorted(rows['event']) == list(range(13))
+
+
+def test_batch_larger_than_buffer_keeps_every_row(tmp_path):
+    journal = AnnotationJournal(str(tmp_path / 'data.journal.test.hdf5'), buffer_size=10)
+    for page in range(40):
+        ids = np.arange(page * 105, (page + 1) * 105)
+        journal.record(ids, np.zeros(105, dtype=np.int16), 2, page=page)
+    journal.flush()
+    assert len(journal.load()) == 4200
+
+
+def test_unwritable_journal_keeps_rows_in_memory(tmp_path):
+    journal = AnnotationJournal(str(tmp_path / 'missing' / 'data.journal.test.hdf5'), buffer_size=10)
+    journal.record(np.arange(25), np.zeros(25, dtype=np.int16), 1, page=1)
+    assert not journal.flush()
+    assert sorted(journal.load()['event']) == list(range(25))